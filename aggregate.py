@@ -0,0 +1,273 @@
+"""Listening rollups behind every chart, computed in a single pass.
+
+Instead of one groupby over the whole play log per chart, aggregate() builds
+an integer-keyed month x day x hour cube and per-artist/track/show totals with
+np.bincount over the categorical codes. Charts read their data from the
+returned Aggregates object.
+
+Aggregates only hold integer sums and counts, so the rollups of two play logs
+can be added (or a part subtracted again) exactly, and saved to .npz files.
+aggregate_chunked() relies on this to aggregate histories larger than memory
+one chunk at a time.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from instrument import stage
+from loader import CHUNK_ROWS, DAY_NAMES, MONTH_NAMES, add_time_features, history_files, iter_frames
+
+MS_PER_HOUR = 3600000
+ARTIST = 'master_metadata_album_artist_name'
+TRACK = 'master_metadata_track_name'
+SHOW = 'episode_show_name'
+ENTITIES = ('artists', 'tracks', 'shows')
+# The export fields aggregate() needs, for loading nothing else.
+AGGREGATE_FIELDS = ['ts', 'ms_played', TRACK, ARTIST, 'episode_name', SHOW]
+CONTENT_TYPES = ['Music', 'Podcast']
+
+
+def month_ordinal(year, month):
+    """Months since January 1970, the ordinal pandas uses for monthly periods."""
+    return (year - 1970) * 12 + month - 1
+
+
+def _codes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, categories = pd.factorize(column)
+    return codes, categories
+
+
+def _entity_totals(column, ms):
+    codes, categories = _codes(column)
+    played = codes >= 0
+    codes = codes[played]
+    totals = pd.DataFrame({
+        'ms': np.bincount(codes, weights=ms[played], minlength=len(categories)).astype(np.int64),
+        'plays': np.bincount(codes, minlength=len(categories)).astype(np.int64),
+    }, index=pd.Index(categories, name=column.name))
+    return totals[totals['plays'] > 0]
+
+
+def _empty_totals(column):
+    return pd.DataFrame({'ms': np.zeros(0, dtype=np.int64), 'plays': np.zeros(0, dtype=np.int64)},
+                        index=pd.Index([], dtype=str, name=column))
+
+
+class Aggregates:
+    """Totals of a play log in milliseconds and play counts.
+
+    `time_ms` and `time_plays` have shape (months, 7, 24): month ordinal
+    (offset by `first_month`), weekday (Monday = 0) and hour. `artists`,
+    `tracks` and `shows` are frames of ms/plays indexed by name; `content`
+    splits ms between music and podcasts.
+    """
+
+    def __init__(self, first_month, time_ms, time_plays, artists, tracks, shows, content):
+        self.first_month = first_month
+        self.time_ms = time_ms
+        self.time_plays = time_plays
+        self.artists = artists
+        self.tracks = tracks
+        self.shows = shows
+        self.content = content
+
+    @classmethod
+    def empty(cls):
+        cube = np.zeros((0, 7, 24), dtype=np.int64)
+        return cls(month_ordinal(1970, 1), cube, cube.copy(),
+                   artists=_empty_totals(ARTIST), tracks=_empty_totals(TRACK), shows=_empty_totals(SHOW),
+                   content=pd.Series(0, index=pd.Index(CONTENT_TYPES, name='content_type'), name='ms'))
+
+    def _combine(self, other, sign):
+        spans = [(a.first_month, a.first_month + len(a.time_ms)) for a in (self, other) if len(a.time_ms)]
+        first = min((start for start, _ in spans), default=month_ordinal(1970, 1))
+        end = max((stop for _, stop in spans), default=first)
+        cubes = []
+        for mine, theirs in ((self.time_ms, other.time_ms), (self.time_plays, other.time_plays)):
+            cube = np.zeros((end - first, 7, 24), dtype=np.int64)
+            start = self.first_month - first
+            cube[start:start + len(mine)] += mine
+            start = other.first_month - first
+            cube[start:start + len(theirs)] += sign * theirs
+            cubes.append(cube)
+        entities = {}
+        for name in ENTITIES:
+            totals = getattr(self, name).add(sign * getattr(other, name), fill_value=0).astype(np.int64)
+            entities[name] = totals[totals['plays'] != 0]
+        content = self.content.add(sign * other.content, fill_value=0).astype(np.int64)
+        return Aggregates(first, *cubes, content=content, **entities).trimmed()
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def trimmed(self):
+        """Drop leading and trailing months without plays from the cube."""
+        played = np.flatnonzero(self.time_plays.sum(axis=(1, 2)))
+        if not len(played):
+            return Aggregates(month_ordinal(1970, 1), self.time_ms[:0], self.time_plays[:0],
+                              self.artists, self.tracks, self.shows, self.content)
+        first, last = played[0], played[-1] + 1
+        return Aggregates(self.first_month + first, self.time_ms[first:last], self.time_plays[first:last],
+                          self.artists, self.tracks, self.shows, self.content)
+
+    def equals(self, other):
+        """True if both hold exactly the same totals."""
+        a, b = self.trimmed(), other.trimmed()
+        if a.first_month != b.first_month and len(a.time_ms):
+            return False
+        if not (np.array_equal(a.time_ms, b.time_ms) and np.array_equal(a.time_plays, b.time_plays)):
+            return False
+        for name in ENTITIES:
+            mine, theirs = getattr(a, name).sort_index(), getattr(b, name).sort_index()
+            if not (mine.index.equals(theirs.index) and np.array_equal(mine.to_numpy(), theirs.to_numpy())):
+                return False
+        return a.content.reindex(CONTENT_TYPES, fill_value=0).tolist() == \
+            b.content.reindex(CONTENT_TYPES, fill_value=0).tolist()
+
+    def save(self, path):
+        arrays = {'first_month': self.first_month, 'time_ms': self.time_ms, 'time_plays': self.time_plays,
+                  'content_ms': self.content.reindex(CONTENT_TYPES, fill_value=0).to_numpy()}
+        for name in ENTITIES:
+            totals = getattr(self, name)
+            arrays[f'{name}_name'] = np.asarray(totals.index, dtype=str)
+            arrays[f'{name}_ms'] = totals['ms'].to_numpy()
+            arrays[f'{name}_plays'] = totals['plays'].to_numpy()
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            entities = {}
+            for name, column in zip(ENTITIES, (ARTIST, TRACK, SHOW)):
+                entities[name] = pd.DataFrame(
+                    {'ms': data[f'{name}_ms'], 'plays': data[f'{name}_plays']},
+                    index=pd.Index(data[f'{name}_name'], dtype=str, name=column))
+            content = pd.Series(data['content_ms'], index=pd.Index(CONTENT_TYPES, name='content_type'),
+                                name='ms')
+            return cls(int(data['first_month']), data['time_ms'], data['time_plays'],
+                       content=content, **entities)
+
+    @property
+    def total_hours(self):
+        return self.time_ms.sum() / MS_PER_HOUR
+
+    def monthly_hours(self):
+        """Hours per calendar month, for months with at least one play."""
+        ms = self.time_ms.sum(axis=(1, 2))
+        played = self.time_plays.sum(axis=(1, 2)) > 0
+        ordinals = self.first_month + np.flatnonzero(played)
+        index = pd.PeriodIndex.from_ordinals(ordinals, freq='M', name='year_month')
+        return pd.Series(ms[played] / MS_PER_HOUR, index=index, name='hours_played')
+
+    def day_hour_hours(self):
+        """Weekday x hour of day matrix of hours, NaN where nothing was played."""
+        hours = self.time_ms.sum(axis=0) / MS_PER_HOUR
+        hours[self.time_plays.sum(axis=0) == 0] = np.nan
+        return pd.DataFrame(hours, index=pd.Index(DAY_NAMES, name='day_of_week'),
+                            columns=pd.RangeIndex(24, name='hour'))
+
+    def year_month_hours(self):
+        """Year x month matrix of hours, NaN where nothing was played."""
+        ms = self.time_ms.sum(axis=(1, 2))
+        plays = self.time_plays.sum(axis=(1, 2))
+        first_year = 1970 + self.first_month // 12
+        offset = self.first_month % 12
+        years = (offset + len(ms) + 11) // 12
+        grid_ms = np.zeros(years * 12)
+        grid_plays = np.zeros(years * 12, dtype=np.int64)
+        grid_ms[offset:offset + len(ms)] = ms
+        grid_plays[offset:offset + len(ms)] = plays
+        hours = (grid_ms / MS_PER_HOUR).reshape(years, 12)
+        hours[grid_plays.reshape(years, 12) == 0] = np.nan
+        table = pd.DataFrame(hours, index=pd.RangeIndex(first_year, first_year + years, name='year'),
+                             columns=pd.Index(MONTH_NAMES, name='month'))
+        return table.dropna(how='all')
+
+    @staticmethod
+    def _top(totals, n):
+        # Ties are ranked by name, so the order does not depend on the order
+        # in which names were first seen.
+        return (totals['ms'].sort_index().nlargest(n) / MS_PER_HOUR).rename('hours_played')
+
+    def top_tracks(self, n=30):
+        return self._top(self.tracks, n)
+
+    def top_artists(self, n=101):
+        return self._top(self.artists, n)
+
+    def top_shows(self, n=10):
+        return self._top(self.shows, n)
+
+    def content_hours(self):
+        """Hours of music and podcast listening."""
+        return (self.content / MS_PER_HOUR).rename('hours_played')
+
+
+def aggregate(df):
+    """Compute the Aggregates of a frame loaded with time features."""
+    ms = df['ms_played'].to_numpy(dtype=np.float64, na_value=0)
+    months = month_ordinal(df['year'].to_numpy(dtype=np.int64),
+                           df['month'].to_numpy(dtype=np.int64))
+    first_month = int(months.min()) if len(months) else month_ordinal(1970, 1)
+    n_months = int(months.max()) - first_month + 1 if len(months) else 0
+    key = (((months - first_month) * 7 + df['day_of_week'].to_numpy(dtype=np.int64)) * 24
+           + df['hour'].to_numpy(dtype=np.int64))
+    shape = (n_months, 7, 24)
+    time_ms = np.bincount(key, weights=ms, minlength=n_months * 168).astype(np.int64).reshape(shape)
+    time_plays = np.bincount(key, minlength=n_months * 168).astype(np.int64).reshape(shape)
+
+    podcast = df['episode_name'].notna().to_numpy()
+    content = pd.Series([int(ms[~podcast].sum()), int(ms[podcast].sum())],
+                        index=pd.Index(CONTENT_TYPES, name='content_type'), name='ms')
+    return Aggregates(first_month, time_ms, time_plays,
+                      artists=_entity_totals(df[ARTIST], ms),
+                      tracks=_entity_totals(df[TRACK], ms),
+                      shows=_entity_totals(df[SHOW], ms),
+                      content=content)
+
+
+def aggregate_by_year(df):
+    """Aggregates of each calendar year in `df`, keyed by year.
+
+    Summing the entries of a few years gives the same result as aggregating
+    the plays of those years, without touching the play log again.
+    """
+    return {int(year): aggregate(part) for year, part in df.groupby('year', sort=True)}
+
+
+def _aggregate_files(paths, chunk_rows=CHUNK_ROWS, tz=None):
+    total = Aggregates.empty()
+    for frame in iter_frames(paths, AGGREGATE_FIELDS, chunk_rows):
+        total = total + aggregate(add_time_features(frame, tz))
+    return total
+
+
+def aggregate_chunked(json_dir, chunk_rows=CHUNK_ROWS, tz=None, workers=1):
+    """Aggregates of `json_dir` without ever loading the whole play log.
+
+    The export files are streamed in frames of `chunk_rows` plays and the
+    Aggregates of each frame are added up, so memory is bounded by one chunk
+    plus the totals. With `workers` > 1 (0 or None: one per core) files are
+    streamed in that many processes. The result equals
+    aggregate(add_time_features(load_history(json_dir), tz)).
+    """
+    paths = history_files(json_dir)
+    if not workers:
+        workers = os.cpu_count()
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        with stage('aggregate.chunks'):
+            return _aggregate_files(paths, chunk_rows, tz)
+    with stage('aggregate.chunks'), ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_aggregate_files, [[path] for path in paths], repeat(chunk_rows), repeat(tz)))
+    with stage('aggregate.merge'):
+        return sum(parts, Aggregates.empty())
@@ -0,0 +1,135 @@
+"""Charts and rollups for many accounts at once.
+
+The root directory holds one export folder (or .zip export) per user. Every
+user is processed in its own worker process (at most `jobs` at a time): their
+rollups are updated in `out_dir`/users/<user>/rollups and their charts written to
+`out_dir`/users/<user>/charts. The totals of all users are then added into a
+combined rollup with its own charts in `out_dir`/combined.
+
+Users are independent, so one failing does not stop the others. A user is
+marked done once their charts are written; running the batch again skips
+users that are done and whose exports have not changed, and retries the rest.
+
+    python batch.py /exports /reports --jobs 4
+"""
+import argparse
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from aggregate import Aggregates
+from rollups import TOTAL, update_rollups
+
+DONE = 'done.json'
+STATUS = 'status.json'
+COMBINED = 'combined'
+
+
+def user_dirs(root):
+    """{user: export} of the folders in `root` with .json files and the .zip exports in it."""
+    users = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and any(f.endswith('.json') for f in os.listdir(path)):
+            users[name] = path
+        elif name.lower().endswith('.zip') and zipfile.is_zipfile(path):
+            users[name[:-4]] = path
+    return users
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def process_user(json_dir, user_dir, formats=('png',), tz=None):
+    """Update one user's rollups and draw their charts unless they are up to date.
+
+    Returns the number of export files read and whether charts were drawn.
+    """
+    # Imported here so the parent process only loads matplotlib for the combined charts.
+    from charts import render_cached
+    done = os.path.join(user_dir, DONE)
+    total, read = update_rollups(json_dir, os.path.join(user_dir, 'rollups'), tz=tz)
+    if not read and os.path.exists(done):
+        return 0, False
+    if os.path.exists(done):
+        os.remove(done)
+    render_cached(total, os.path.join(user_dir, 'charts'), formats=formats)
+    _write_json(done, {'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                       'hours': total.total_hours})
+    return len(read), True
+
+
+def combine(out_dir, users, formats=('png',)):
+    """Add up the rollups of `users` and draw the combined charts."""
+    from charts import render_cached
+    total = sum((Aggregates.load(os.path.join(out_dir, 'users', user, 'rollups', TOTAL)) for user in users),
+                Aggregates.empty())
+    combined_dir = os.path.join(out_dir, COMBINED)
+    os.makedirs(combined_dir, exist_ok=True)
+    total.save(os.path.join(combined_dir, TOTAL))
+    render_cached(total, os.path.join(combined_dir, 'charts'), formats=formats)
+    _write_json(os.path.join(combined_dir, 'users.json'), sorted(users))
+    return total
+
+
+def run_batch(root, out_dir, jobs=1, formats=('png',), tz=None):
+    """Process every user in `root` and combine their rollups.
+
+    Returns {user: status entry}; users that failed are left out of the
+    combined rollup and retried on the next run.
+    """
+    users = user_dirs(root)
+    status_path = os.path.join(out_dir, STATUS)
+    os.makedirs(out_dir, exist_ok=True)
+    status = {}
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), max(len(users), 1))) as pool:
+        futures = {pool.submit(process_user, json_dir, os.path.join(out_dir, 'users', user), formats, tz): user
+                   for user, json_dir in users.items()}
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                read, drawn = future.result()
+            except Exception as exc:
+                status[user] = {'status': 'failed', 'error': f'{type(exc).__name__}: {exc}'}
+            else:
+                status[user] = {'status': 'done' if drawn else 'unchanged', 'files_read': read}
+            # Written after every user, so an interrupted batch leaves a record.
+            _write_json(status_path, dict(sorted(status.items())))
+            print(f"{user}: {status[user]['status']}", flush=True)
+
+    succeeded = sorted(user for user, entry in status.items() if entry['status'] != 'failed')
+    changed = any(entry['status'] == 'done' for entry in status.values())
+    try:
+        with open(os.path.join(out_dir, COMBINED, 'users.json')) as f:
+            combined = json.load(f)
+    except FileNotFoundError:
+        combined = None
+    if succeeded and (changed or combined != succeeded):
+        total = combine(out_dir, succeeded, formats)
+        print(f'combined {len(succeeded)} user(s): {total.total_hours:.1f} hours')
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rollups and charts for a directory of per-user exports.')
+    parser.add_argument('root', help='directory with one export folder per user')
+    parser.add_argument('out_dir')
+    parser.add_argument('--jobs', type=int, default=1, help='users processed at once (0 = one per core)')
+    parser.add_argument('--formats', nargs='+', default=['png'], choices=['png', 'svg', 'pdf', 'html'])
+    parser.add_argument('--tz', help='timezone for hours and dates (default: UTC)')
+    args = parser.parse_args()
+    status = run_batch(args.root, args.out_dir, args.jobs, args.formats, args.tz)
+    failed = sorted(user for user, entry in status.items() if entry['status'] == 'failed')
+    if failed:
+        print(f"{len(failed)} user(s) failed, run again to retry: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""End-to-end benchmark of the analysis pipeline on synthetic exports.
+
+For each size, synthetic export files are generated (or reused from an
+earlier run) and the pipeline is run stage by stage: load, feature
+extraction, aggregation and chart rendering. Every stage records wall time,
+CPU time and peak memory (see instrument.py), and the results are written as
+JSON so runs can be compared.
+
+    python bench.py --sizes 100000 1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from aggregate import aggregate
+from instrument import Profiler, stage
+from loader import add_time_features, history_files, load_history
+from synth import generate
+
+
+def dataset(data_dir, rows, seed=0):
+    """Directory of synthetic exports with `rows` plays, generated on first use."""
+    path = os.path.join(data_dir, f'synthetic_{rows}_{seed}')
+    marker = os.path.join(path, '.complete')
+    if not os.path.exists(marker):
+        generate(path, rows, seed=seed)
+        open(marker, 'w').close()
+    return path
+
+
+def run(json_dir, workers=1, render=True, trace=True):
+    """Run the pipeline on `json_dir` and return the per-stage measurements."""
+    with Profiler(trace_memory=trace) as profiler:
+        with stage('load'):
+            df = load_history(json_dir, workers=workers)
+        with stage('features'):
+            df = add_time_features(df)
+        with stage('aggregate'):
+            agg = aggregate(df)
+        if render:
+            # Imported here so benchmarks without rendering do not load matplotlib.
+            from charts import render_all
+            with tempfile.TemporaryDirectory() as out_dir, stage('render'):
+                render_all(agg, out_dir, workers=workers)
+    return {'rows': len(df), 'files': len(history_files(json_dir)), 'stages': profiler.stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark load, features, aggregation and rendering.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000],
+                        help='numbers of synthetic plays to benchmark (100k to 50M)')
+    parser.add_argument('--json-dir', help='benchmark this export directory instead of synthetic data')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'spotify-bench'),
+                        help='where synthetic exports are generated and kept between runs')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--no-render', action='store_true')
+    parser.add_argument('--no-trace', action='store_true',
+                        help='skip tracemalloc, which slows down the load stage')
+    parser.add_argument('--output', help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    dirs = [args.json_dir] if args.json_dir else [dataset(args.data_dir, rows) for rows in args.sizes]
+    runs = []
+    for json_dir in dirs:
+        result = run(json_dir, args.workers, not args.no_render, not args.no_trace)
+        result['json_dir'] = json_dir
+        runs.append(result)
+        print(f"{result['rows']} rows in {result['files']} file(s)")
+        for entry in result['stages']:
+            if entry['depth'] == 0:
+                memory = f"{entry['peak_traced_mb']:9.1f} MB peak" if 'peak_traced_mb' in entry else ''
+                print(f"  {entry['stage']:<10} {entry['wall_s']:8.2f} s wall {entry['cpu_s']:8.2f} s cpu {memory}")
+
+    if args.output:
+        report = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'runs': runs,
+        }
+        history = []
+        if os.path.exists(args.output):
+            with open(args.output) as f:
+                history = json.load(f)
+        history.append(report)
+        with open(args.output, 'w') as f:
+            json.dump(history, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
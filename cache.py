@@ -0,0 +1,165 @@
+"""On-disk cache of the normalized play log.
+
+Every export file gets its own columnar part (Parquet when pyarrow is
+installed, pickle otherwise) holding the loaded frame with its time features
+already computed. A manifest records the size, mtime and SHA-1 of the source
+file each part was built from, so only new or changed files are parsed again.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+
+from instrument import stage
+from loader import (FIELDS, ColumnBuffers, field_kinds, add_time_features, concat_frames, export_stat, history_files,
+                    open_export, read_file)
+
+CACHE_VERSION = 3
+MANIFEST = 'manifest.json'
+
+try:
+    import pyarrow  # noqa: F401
+    PART_FORMAT = 'parquet'
+except ImportError:
+    PART_FORMAT = 'pickle'
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open_export(path, binary=True) as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(path, sha1=None):
+    size, mtime_ns = export_stat(path)
+    return {'size': size, 'mtime_ns': mtime_ns, 'sha1': sha1 or file_sha1(path)}
+
+
+def is_fresh(entry, path):
+    """True if the cached `entry` was built from the current contents of `path`.
+
+    Size and mtime are checked first; the file is only hashed when its size is
+    unchanged but its mtime moved (e.g. the export was unzipped again).
+    """
+    if entry is None:
+        return False
+    size, mtime_ns = export_stat(path)
+    if size != entry['size']:
+        return False
+    if mtime_ns == entry['mtime_ns']:
+        return True
+    if file_sha1(path) == entry['sha1']:
+        entry['mtime_ns'] = mtime_ns
+        return True
+    return False
+
+
+def read_part(path):
+    if not path.endswith('.parquet'):
+        return pd.read_pickle(path)
+    df = pd.read_parquet(path)
+    # String columns that are entirely null come back from Parquet as object.
+    for name in df.columns:
+        if FIELDS.get(name) == 'str' and not isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].astype('category')
+        # Parquet stores timestamps in milliseconds; the loader yields seconds.
+        elif FIELDS.get(name) == 'ts' and df[name].dtype != 'datetime64[s, UTC]':
+            df[name] = df[name].astype('datetime64[s, UTC]')
+    return df
+
+
+def write_part(df, path):
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_pickle(path)
+
+
+def build_part(path, part_path, fields=None, tz=None):
+    """Load one export file, add its features and store it as a cache part."""
+    df = add_time_features(read_file(path, fields), tz)
+    write_part(df, part_path)
+    return df, fingerprint(path)
+
+
+def _schema(fields, tz):
+    return {'version': CACHE_VERSION, 'fields': sorted(field_kinds(fields)), 'tz': tz, 'format': PART_FORMAT}
+
+
+def read_manifest(cache_dir, schema=None):
+    """Return the manifest's file entries, or {} if it was built with another schema."""
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if schema is not None and manifest.get('schema') != schema:
+        return {}
+    return manifest['files']
+
+
+def write_manifest(cache_dir, schema, files):
+    tmp = os.path.join(cache_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'schema': schema, 'files': files}, f, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, MANIFEST))
+
+
+def load_cached(json_dir, cache_dir, fields=None, workers=1, tz=None):
+    """Load `json_dir` with time features, reusing cached parts where possible.
+
+    Returns the same frame as add_time_features(load_history(json_dir), tz).
+    Parts of files that disappeared from `json_dir` are removed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    schema = _schema(fields, tz)
+    cached = read_manifest(cache_dir, schema)
+    paths = history_files(json_dir)
+    files = {}
+    stale = []
+    for path in paths:
+        name = os.path.basename(path)
+        entry = cached.pop(name, None)
+        if is_fresh(entry, path) and os.path.exists(os.path.join(cache_dir, entry['part'])):
+            files[name] = entry
+        else:
+            stale.append(path)
+    for entry in cached.values():
+        part = os.path.join(cache_dir, entry['part'])
+        if os.path.exists(part):
+            os.remove(part)
+
+    part_names = [hashlib.sha1(os.path.basename(p).encode()).hexdigest()[:16] + '.' + PART_FORMAT
+                  for p in stale]
+    part_paths = [os.path.join(cache_dir, name) for name in part_names]
+    workers = min(workers or os.cpu_count(), len(stale))
+    with stage('load.cache.build'):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                built = list(pool.map(build_part, stale, part_paths, repeat(fields), repeat(tz)))
+        else:
+            built = [build_part(path, part, fields, tz) for path, part in zip(stale, part_paths)]
+    fresh_frames = {}
+    for path, part_name, (df, fp) in zip(stale, part_names, built):
+        name = os.path.basename(path)
+        files[name] = dict(fp, part=part_name)
+        fresh_frames[name] = df
+    write_manifest(cache_dir, schema, files)
+
+    frames = []
+    with stage('load.cache.read'):
+        for path in paths:
+            name = os.path.basename(path)
+            if name in fresh_frames:
+                frames.append(fresh_frames.pop(name))
+            else:
+                frames.append(read_part(os.path.join(cache_dir, files[name]['part'])))
+    if not frames:
+        return add_time_features(ColumnBuffers(fields).to_frame(), tz)
+    with stage('load.merge'):
+        return concat_frames(frames)
@@ -0,0 +1,372 @@
+"""The chart set of main.py, drawn from an Aggregates object.
+
+Every chart is a pair of functions: one that picks its (small) data out of the
+aggregates and one that draws that data on a new figure. render_all() uses
+the split to draw independent charts in worker processes with the Agg
+backend, sending each worker only the data of its chart, and render_cached()
+also skips the charts whose data has not changed since they were written.
+
+Value labels are drawn with batch_labels(): one collection of glyph outlines
+per call instead of one Text artist per label, which matplotlib lays out and
+draws one by one. 'html' output is drawn with plotly by interactive.py.
+"""
+import hashlib
+import json
+import os
+import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+
+import instrument
+from instrument import stage
+
+# Bump when the drawing code changes, so render_cached() draws every chart again.
+RENDER_VERSION = 3
+DIGESTS = 'charts.json'
+IMAGE_FORMATS = ('png', 'svg', 'pdf')
+FORMATS = IMAGE_FORMATS + ('html',)
+
+# Label of the collections batch_labels() draws (the underscore keeps them out of legends).
+LABELS = '_batch_labels'
+_ALIGN = {'left': 0, 'bottom': 0, 'center': 0.5, 'right': 1, 'top': 1}
+
+
+def batch_labels(ax, x, y, labels, size=None, ha='center', va='center', color='black', offset=(0, 0)):
+    """Draw text `labels` at data positions (`x`, `y`) as a single artist.
+
+    `offset` shifts every label by (dx, dy) points and `color` may be one
+    color or one per label. Labels keep their size in points when the axes
+    are resized, like Text, but are drawn as glyph outlines, so vector output
+    does not contain them as selectable text.
+    """
+    prop = FontProperties(size=size)
+    anchor = np.array([_ALIGN[ha], _ALIGN[va]])
+    outlines = {}
+    paths = []
+    for label in labels:
+        path = outlines.get(label)
+        if path is None:
+            text = TextPath((0, 0), label, prop=prop) if label.strip() else None
+            if text is not None and len(text.vertices):
+                # Aligned on the outline's control points: exact enough, and
+                # much cheaper than Path.get_extents() on the glyph curves.
+                low, high = text.vertices.min(axis=0), text.vertices.max(axis=0)
+                path = Path(text.vertices - low - (high - low) * anchor + offset, text.codes)
+            else:
+                path = Path(np.zeros((1, 2)), [Path.MOVETO])
+            outlines[label] = path
+        paths.append(path)
+    collection = PathCollection(paths, offsets=np.column_stack([x, y]), offset_transform=ax.transData,
+                                transform=Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans,
+                                facecolors=color, edgecolors='none', zorder=3, label=LABELS)
+    # Like Text, labels may extend past the axes (e.g. above the tallest bar).
+    collection.set_clip_on(False)
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+
+def label_extents(collection):
+    """(x0, y0, x1, y1) in display pixels of every label drawn by batch_labels()."""
+    boxes = np.array([np.concatenate([path.vertices.min(axis=0), path.vertices.max(axis=0)])
+                      for path in collection.get_paths()]).reshape(-1, 4)
+    offsets = collection.get_offset_transform().transform(collection.get_offsets())
+    return boxes * (collection.figure.dpi / 72) + np.tile(offsets, 2)
+
+
+def labels_outside(fig, tolerance=1.0):
+    """Number of batch_labels() labels in `fig` that extend past its edges, as laid out now."""
+    x0, y0, x1, y1 = fig.bbox.extents
+    outside = 0
+    for ax in fig.axes:
+        for collection in ax.collections:
+            if collection.get_label() == LABELS:
+                boxes = label_extents(collection)
+                outside += int(np.count_nonzero((boxes[:, 0] < x0 - tolerance) | (boxes[:, 1] < y0 - tolerance)
+                                                | (boxes[:, 2] > x1 + tolerance) | (boxes[:, 3] > y1 + tolerance)))
+    return outside
+
+
+def _relative_luminance(rgba):
+    rgb = rgba[..., :3]
+    rgb = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return rgb @ [0.2126, 0.7152, 0.0722]
+
+
+def heatmap(ax, frame, cmap='viridis', fmt='.1f', label='Hours Played', annot=True):
+    """A seaborn-style annotated heatmap of `frame`, with the cell labels batched.
+
+    NaN cells are left blank. Returns the QuadMesh.
+    """
+    values = frame.to_numpy(dtype=float)
+    mesh = ax.pcolormesh(np.ma.masked_invalid(values), cmap=cmap, edgecolors='white', linewidth=0.5)
+    ax.figure.colorbar(mesh, ax=ax, label=label)
+    rows, columns = values.shape
+    ax.set_xticks(np.arange(columns) + 0.5, [str(c) for c in frame.columns])
+    ax.set_yticks(np.arange(rows) + 0.5, [str(r) for r in frame.index])
+    ax.set_xlim(0, columns)
+    ax.set_ylim(rows, 0)
+    ax.tick_params(length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.set_xlabel(frame.columns.name or '')
+    ax.set_ylabel(frame.index.name or '')
+    if annot:
+        filled = np.isfinite(values)
+        i, j = np.nonzero(filled)
+        # Dark text on light cells and light text on dark cells, as seaborn does.
+        light = _relative_luminance(mesh.cmap(mesh.norm(values[filled]))) > 0.408
+        batch_labels(ax, j + 0.5, i + 0.5, [format(v, fmt) for v in values[filled]],
+                     color=np.where(light, '.15', 'white'))
+    return mesh
+
+
+def draw_monthly_hours(monthly_hours):
+    # Time series of total listening time
+    fig, ax = plt.subplots(figsize=(12, 6))
+    colors = [plt.cm.tab20(year % 20) for year in monthly_hours.index.year]
+    monthly_hours.plot(kind='bar', width=0.8, color=colors, ax=ax)
+    ax.set_title('Monthly Listening Time')
+    ax.set_ylabel('Hours Played')
+    ax.set_xlabel('Month/Year')
+    ax.set_xticklabels([f"{x.month:02d}/{x.year % 100:02d}" for x in monthly_hours.index], rotation=90)
+
+    # Add labels at the top of the bars, alternately just inside and just above.
+    # Bars sit at their ticks (pandas places Period bars at the period ordinals).
+    labels = [f"{value:.1f}" for value in monthly_hours]
+    positions = ax.get_xticks()
+    values = monthly_hours.to_numpy()
+    batch_labels(ax, positions[::2], values[::2] + 0.5, labels[::2], va='top')
+    batch_labels(ax, positions[1::2], values[1::2] - 0.5, labels[1::2], va='bottom')
+    return fig
+
+
+def draw_day_hour_heatmap(heatmap_data):
+    # Heatmap of listening hours vs. days of the week
+    fig, ax = plt.subplots(figsize=(14, 8))
+    heatmap(ax, heatmap_data, cmap='viridis')
+    ax.set_title('Listening Hours vs. Days of the Week')
+    ax.set_xlabel('Hour of the Day')
+    ax.set_ylabel('Day of the Week')
+    return fig
+
+
+def draw_year_month_heatmap(monthly_heatmap_data):
+    # Heatmap of listening hours per month of the year
+    fig, ax = plt.subplots(figsize=(14, 8))
+    heatmap(ax, monthly_heatmap_data, cmap='viridis')
+    ax.set_title('Total Listening Hours per Month of the Year')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Year')
+    return fig
+
+
+def draw_top_tracks(top_tracks):
+    fig, ax = plt.subplots(figsize=(12, 6))
+    top_tracks.plot(kind='bar', title=f'Top {len(top_tracks)} Tracks by Listening Time', ax=ax)
+    ax.set_ylabel('Hours Played')
+    ax.set_xlabel('Track Name')
+    ax.tick_params(axis='x', labelrotation=90)
+    return fig
+
+
+def draw_top_artists(top_artists):
+    fig, ax = plt.subplots(figsize=(12, 6))
+    top_artists.plot(kind='bar', title='Top Artists by Listening Time', ax=ax)
+    ax.set_ylabel('Hours Played')
+    ax.set_xlabel('Artist Name')
+    ax.tick_params(axis='x', labelrotation=90)
+    return fig
+
+
+def draw_top_artists_scatter(top_artists):
+    # Scatter plot with square markers of the top 101 artists
+    top_artists_df = top_artists.reset_index()
+    fig, ax = plt.subplots(figsize=(20, 5))
+    scatter = ax.scatter(
+        x=top_artists_df['hours_played'],
+        y=top_artists_df['master_metadata_album_artist_name'],
+        s=top_artists_df['hours_played'] * 12,  # Adjust the size of the squares
+        c=top_artists_df['hours_played'] * 15,
+        cmap='viridis',
+        alpha=0.6,
+        edgecolors='w',
+        linewidth=2.5
+    )
+    fig.colorbar(scatter, ax=ax, label='Hours Played')
+    ax.set_title(f'Top {len(top_artists)} Artists by Listening Time')
+    ax.set_xlabel('Hours Played')
+    ax.set_ylabel('Artist Name')
+    return fig
+
+
+def draw_content_pie(content_type):
+    # Podcast vs. music
+    fig, ax = plt.subplots(figsize=(8, 8))
+    content_type.plot(kind='pie', autopct='%1.1f%%', title='Podcast vs. Music Listening Time',
+                      textprops={'fontsize': 14}, ax=ax)
+    ax.set_ylabel('')
+    return fig
+
+
+def draw_top_shows(top_podcasts):
+    fig, ax = plt.subplots(figsize=(12, 6))
+    top_podcasts.plot(kind='bar', title=f'Top {len(top_podcasts)} Podcast Shows', ax=ax)
+    ax.set_ylabel('Hours Played')
+    ax.set_xlabel('Podcast Show')
+    ax.tick_params(axis='x', labelrotation=45)
+    return fig
+
+
+# name -> (data from Aggregates, drawing function), in display order
+CHARTS = {
+    'monthly_hours': (lambda agg: agg.monthly_hours(), draw_monthly_hours),
+    'day_hour_heatmap': (lambda agg: agg.day_hour_hours(), draw_day_hour_heatmap),
+    'year_month_heatmap': (lambda agg: agg.year_month_hours(), draw_year_month_heatmap),
+    'top_tracks': (lambda agg: agg.top_tracks(30), draw_top_tracks),
+    'top_artists': (lambda agg: agg.top_artists(101), draw_top_artists),
+    'top_artists_scatter': (lambda agg: agg.top_artists(101), draw_top_artists_scatter),
+    'content_pie': (lambda agg: agg.content_hours(), draw_content_pie),
+    'top_shows': (lambda agg: agg.top_shows(10), draw_top_shows),
+}
+
+
+def chart_data(name, agg):
+    return CHARTS[name][0](agg)
+
+
+def chart_digest(data):
+    """Hash of a chart's data and RENDER_VERSION, to tell whether the chart needs drawing again."""
+    return hashlib.sha1(pickle.dumps((RENDER_VERSION, data), protocol=4)).hexdigest()
+
+
+def has_data(data):
+    """Whether a chart's data has anything to draw (e.g. top shows of a music-only history do not)."""
+    values = np.asarray(data, dtype=float)
+    return values.size > 0 and np.nansum(values) > 0
+
+
+def draw_empty(name):
+    """Placeholder figure for a chart without data, so one empty chart never fails a render."""
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.set_title(name.replace('_', ' ').capitalize())
+    ax.text(0.5, 0.5, 'No data', ha='center', va='center', fontsize=14, color='grey', transform=ax.transAxes)
+    ax.set_axis_off()
+    return fig
+
+
+def draw_chart(name, data):
+    with stage(f'render.{name}.draw'):
+        fig = CHARTS[name][1](data) if has_data(data) else draw_empty(name)
+    with stage(f'render.{name}.layout'):
+        fig.tight_layout()
+    return fig
+
+
+def render_chart(name, data, out_dir, formats=('png',)):
+    """Draw one chart and save it as `out_dir`/`name`.<format> for each format."""
+    paths = {}
+    with stage(f'render.{name}'):
+        images = [fmt for fmt in formats if fmt in IMAGE_FORMATS]
+        if images:
+            fig = draw_chart(name, data)
+            outside = labels_outside(fig)
+            if outside:
+                warnings.warn(f'{name}: {outside} value label(s) extend past the edge of the figure')
+            try:
+                with stage(f'render.{name}.save'):
+                    for fmt in images:
+                        paths[fmt] = os.path.join(out_dir, f'{name}.{fmt}')
+                        fig.savefig(paths[fmt])
+            finally:
+                plt.close(fig)
+        if 'html' in formats:
+            # Imported here so image-only renders never load plotly.
+            from interactive import write_html
+            with stage(f'render.{name}.html'):
+                paths['html'] = write_html(name, data, out_dir)
+    return [paths[fmt] for fmt in formats]
+
+
+def _render_profiled(name, data, out_dir, formats, trace_memory):
+    # Worker side of render_all when the parent is profiling.
+    with instrument.Profiler(trace_memory=trace_memory) as profiler:
+        paths = render_chart(name, data, out_dir, formats)
+    return paths, profiler.stages
+
+
+def _use_agg():
+    matplotlib.use('Agg')
+
+
+def _render(names, data, out_dir, formats, workers):
+    os.makedirs(out_dir, exist_ok=True)
+    if 'html' in formats:
+        # Written once here rather than by every worker.
+        from interactive import write_plotly_js
+        write_plotly_js(out_dir)
+    if not workers:
+        workers = os.cpu_count()
+    workers = min(workers, len(names))
+    if workers <= 1:
+        _use_agg()
+        paths = [render_chart(name, d, out_dir, formats) for name, d in zip(names, data)]
+    else:
+        profiler = instrument.active()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+            if profiler is None:
+                paths = list(pool.map(render_chart, names, data,
+                                      [out_dir] * len(names), [formats] * len(names)))
+            else:
+                results = list(pool.map(_render_profiled, names, data, [out_dir] * len(names),
+                                        [formats] * len(names), [profiler.trace_memory] * len(names)))
+                paths = [chart_paths for chart_paths, _ in results]
+                for _, stages in results:
+                    profiler.extend(stages)
+    return dict(zip(names, paths))
+
+
+def render_all(agg, out_dir, formats=('png',), workers=1, names=None):
+    """Render the charts in `names` (default: all) to files without a display.
+
+    `formats` are file extensions from FORMATS. With `workers` > 1 (0 or
+    None: one per core) charts are drawn in that many processes. Returns
+    {chart name: [written paths]}.
+    """
+    names = list(CHARTS if names is None else names)
+    return _render(names, [chart_data(name, agg) for name in names], out_dir, formats, workers)
+
+
+def render_cached(agg, out_dir, formats=('png',), workers=1, names=None):
+    """render_all() for only the charts whose data changed since they were written.
+
+    The digest of every chart's data is kept in `out_dir`/charts.json; a chart
+    is drawn again when its digest differs or one of its files is missing.
+    Returns ({chart name: [paths]} of all charts in `names`, [names drawn]).
+    """
+    names = list(CHARTS if names is None else names)
+    digests_path = os.path.join(out_dir, DIGESTS)
+    try:
+        with open(digests_path) as f:
+            drawn = json.load(f)
+    except (FileNotFoundError, ValueError):
+        drawn = {}
+    data = {name: chart_data(name, agg) for name in names}
+    digests = {name: chart_digest(d) for name, d in data.items()}
+    paths = {name: [os.path.join(out_dir, f'{name}.{fmt}') for fmt in formats] for name in names}
+    stale = [name for name in names
+             if drawn.get(name) != digests[name] or not all(os.path.exists(path) for path in paths[name])]
+    if stale:
+        _render(stale, [data[name] for name in stale], out_dir, formats, workers)
+        drawn.update(digests)
+        with open(digests_path, 'w') as f:
+            json.dump(drawn, f, indent=1)
+    return paths, stale
@@ -0,0 +1,148 @@
+"""Single entry point for the analysis tools, with fast startup.
+
+Nothing heavy is imported until a command runs, and only the render and
+watch commands load the plotting libraries, so numbers-only commands (e.g. from
+cron) skip the several seconds the plotting libraries take to import.
+
+    python cli.py aggregate /path/to/MyData --rollup-dir state/ --json summary.json
+    python cli.py render --json-dir /path/to/MyData --out charts/
+    python cli.py startup-check
+
+Every other command runs the `main()` of its module with the remaining
+arguments, e.g. `python cli.py export /path/to/MyData exports/`.
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# command -> (module whose main() it runs, description)
+COMMANDS = {
+    'render': ('main', 'draw the charts (loads the plotting libraries)'),
+    'watch': ('watch', 'redraw the charts whenever the exports change'),
+    'batch': ('batch', 'rollups and charts for a directory of per-user exports'),
+    'rollups': ('rollups', 'update persisted rollups'),
+    'export': ('export', 'per-artist track hours'),
+    'topk': ('topk', 'approximate top lists in one pass'),
+    'store': ('store', 'build or query the time-sorted play log store'),
+    'cube': ('cube', 'build or query the artist/track x month cubes'),
+    'sessions': ('sessions', 'listening sessions'),
+    'similar': ('similar', 'artists listened to together'),
+    'dedup': ('dedup', 'plays repeated across overlapping exports'),
+    'serve': ('service', 'HTTP/JSON service of the chart aggregates'),
+}
+PLOTTING = ('matplotlib', 'seaborn', 'plotly', 'mplcursors')
+# Seconds `cli.py aggregate` may take on a one-play export, interpreter startup included.
+STARTUP_BUDGET_S = 1.5
+
+
+def _series(series):
+    return {str(label): float(value) for label, value in series.items()}
+
+
+def summary(agg, n=10):
+    """The numbers behind the charts as plain JSON-ready data."""
+    return {
+        'total_hours': agg.total_hours,
+        'content_hours': _series(agg.content_hours()),
+        'monthly_hours': _series(agg.monthly_hours()),
+        'top_artists': _series(agg.top_artists(n)),
+        'top_tracks': _series(agg.top_tracks(n)),
+        'top_shows': _series(agg.top_shows(n)),
+    }
+
+
+def aggregate_command(argv):
+    parser = argparse.ArgumentParser(prog='cli.py aggregate',
+                                     description='Print the chart aggregates as JSON, without plotting.')
+    parser.add_argument('json_dir', help='export directory or .zip')
+    parser.add_argument('--rollup-dir', help='update and read persisted rollups kept here')
+    parser.add_argument('--backend', choices=['memory', 'chunked'], default='memory')
+    parser.add_argument('--dedup-dir', help='leave out plays repeated across overlapping exports '
+                                            '(not with --backend chunked)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tz', help='timezone for hours and dates (default: UTC)')
+    parser.add_argument('-n', type=int, default=10, help='entries per top list')
+    parser.add_argument('--json', metavar='PATH', help='write to PATH instead of stdout')
+    args = parser.parse_args(argv)
+    if args.dedup_dir and args.backend == 'chunked' and not args.rollup_dir:
+        parser.error('--dedup-dir cannot be combined with --backend chunked')
+
+    from aggregate import AGGREGATE_FIELDS, aggregate, aggregate_chunked
+    if args.rollup_dir:
+        from rollups import update_rollups
+        agg, _ = update_rollups(args.json_dir, args.rollup_dir, workers=args.workers, tz=args.tz,
+                                dedup_dir=args.dedup_dir)
+    elif args.backend == 'chunked':
+        agg = aggregate_chunked(args.json_dir, tz=args.tz, workers=args.workers)
+    elif args.dedup_dir:
+        from dedup import load_deduplicated
+        from loader import add_time_features
+        df, _ = load_deduplicated(args.json_dir, args.dedup_dir, AGGREGATE_FIELDS, args.workers)
+        agg = aggregate(add_time_features(df, args.tz))
+    else:
+        from loader import add_time_features, load_history
+        agg = aggregate(add_time_features(load_history(args.json_dir, AGGREGATE_FIELDS, args.workers), args.tz))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary(agg, args.n), f, indent=1, ensure_ascii=False)
+    else:
+        json.dump(summary(agg, args.n), sys.stdout, indent=1, ensure_ascii=False)
+        print()
+
+
+def startup_check(argv):
+    """Time the aggregate command in fresh interpreters and check it loads no plotting library."""
+    parser = argparse.ArgumentParser(prog='cli.py startup-check',
+                                     description='Measure the startup time of the aggregate command.')
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_S, help='seconds allowed')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A one-play export, so the run is all startup and imports.
+        with open(os.path.join(tmp, 'Streaming_History_Audio_0.json'), 'w') as f:
+            json.dump([{'ts': '2024-01-01T00:00:00Z', 'ms_played': 1000, 'master_metadata_track_name': 'Track',
+                        'master_metadata_album_artist_name': 'Artist'}], f)
+        probe = (f'import sys, cli; cli.main(["aggregate", {tmp!r}, "--json", {os.devnull!r}]); '
+                 f'print(",".join(m for m in sys.modules if m.split(".")[0] in {PLOTTING!r}))')
+        times = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            loaded = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+            times.append(time.perf_counter() - started)
+    median = sorted(times)[len(times) // 2]
+    print(f'aggregate startup: median {median:.2f} s over {args.runs} runs (budget {args.budget:.2f} s)')
+    if loaded:
+        print(f'plotting modules imported by the aggregate command: {loaded}')
+    if median > args.budget or loaded:
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help') or argv[0] not in (*COMMANDS, 'aggregate', 'startup-check'):
+        print(__doc__.strip().splitlines()[0] + '\n\ncommands:')
+        print(f"  {'aggregate':<14} chart numbers as JSON, without plotting")
+        for command, (_, description) in COMMANDS.items():
+            print(f'  {command:<14} {description}')
+        print(f"  {'startup-check':<14} time the no-plot startup against its budget")
+        raise SystemExit(0 if argv and argv[0] in ('-h', '--help') else 2)
+    command, rest = argv[0], argv[1:]
+    if command == 'aggregate':
+        aggregate_command(rest)
+    elif command == 'startup-check':
+        startup_check(rest)
+    else:
+        module = importlib.import_module(COMMANDS[command][0])
+        sys.argv = [f'cli.py {command}'] + rest
+        module.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Artist x month and track x month cubes of listening time.
+
+Each cube keeps the (entity, month) cells with plays in entity-then-month
+order, next to the running total of their milliseconds. The total of any
+entity over any month range is then the difference of two running totals
+found by binary search, for all entities at once, so date-range totals,
+monthly series, rolling windows and rank-over-time charts never rescan the
+play log.
+
+    python cube.py build /path/to/MyData cube.npz
+    python cube.py series cube.npz --artist Tchaikovsky
+    python cube.py rolling cube.npz --window 3 -n 5
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from aggregate import AGGREGATE_FIELDS, ARTIST, MS_PER_HOUR, TRACK, _codes, month_ordinal
+from loader import add_time_features, load_history
+
+CUBE_ENTITIES = {'artists': ARTIST, 'tracks': TRACK}
+
+
+def _month(value):
+    """Month ordinal of a 'YYYY-MM' string, date or Period."""
+    return pd.Period(value, freq='M').ordinal
+
+
+class EntityCube:
+    """Milliseconds played per (entity, month) with running totals.
+
+    Cell i is entity keys[i] // n_months in month first_month + keys[i] %
+    n_months; cum[i + 1] - cum[i] is its ms, and cum runs across entities.
+    """
+
+    def __init__(self, name, names, first_month, n_months, keys, cum):
+        self.name = name
+        self.names = list(names)
+        self.first_month = first_month
+        self.n_months = n_months
+        self.keys = keys
+        self.cum = cum
+        self._codes = {entity: code for code, entity in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, name, codes, names, months, ms):
+        played = codes >= 0
+        codes, months, ms = codes[played], months[played], ms[played]
+        first_month = int(months.min()) if len(months) else month_ordinal(1970, 1)
+        n_months = int(months.max()) - first_month + 1 if len(months) else 0
+        keys, inverse = np.unique(codes * n_months + (months - first_month), return_inverse=True)
+        cells = np.bincount(inverse, weights=ms).astype(np.int64)
+        cum = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum(cells, out=cum[1:])
+        return cls(name, names, first_month, n_months, keys, cum)
+
+    def _bounds(self, start, end):
+        lo = 0 if start is None else min(max(_month(start) - self.first_month, 0), self.n_months)
+        hi = self.n_months if end is None else min(max(_month(end) - self.first_month + 1, lo), self.n_months)
+        return lo, hi
+
+    def _range(self, codes, lo, hi):
+        # Running totals at the first cell of each entity at month lo and at hi.
+        base = codes * self.n_months
+        return self.cum[np.searchsorted(self.keys, base + hi)] - self.cum[np.searchsorted(self.keys, base + lo)]
+
+    def range_ms(self, start=None, end=None):
+        """ms of every entity code in the months from `start` to `end`, both included."""
+        return self._range(np.arange(len(self.names), dtype=np.int64), *self._bounds(start, end))
+
+    def hours(self, start=None, end=None):
+        """Hours of every entity with plays in the month range, as a Series."""
+        ms = self.range_ms(start, end)
+        played = np.flatnonzero(ms)
+        return pd.Series(ms[played] / MS_PER_HOUR, index=pd.Index([self.names[c] for c in played], name=self.name),
+                         name='hours_played')
+
+    def top(self, n=10, start=None, end=None):
+        """The `n` entities with the most hours in the month range (ties by name)."""
+        return self.hours(start, end).sort_index().nlargest(n)
+
+    def series(self, entity, start=None, end=None):
+        """Monthly hours of one entity, including months without plays."""
+        lo, hi = self._bounds(start, end)
+        code = self._codes.get(entity)
+        ms = np.zeros(hi - lo, dtype=np.int64)
+        if code is not None:
+            first, last = np.searchsorted(self.keys, [code * self.n_months + lo, code * self.n_months + hi])
+            months = self.keys[first:last] - code * self.n_months - lo
+            ms[months] = np.diff(self.cum[first:last + 1])
+        return pd.Series(ms / MS_PER_HOUR, index=self._months()[lo:hi], name='hours_played')
+
+    def _months(self):
+        return pd.PeriodIndex.from_ordinals(self.first_month + np.arange(self.n_months), freq='M',
+                                            name='year_month')
+
+    def _windows(self, window):
+        # Months ending every window, and the window totals of all entities per month.
+        codes = np.arange(len(self.names), dtype=np.int64)
+        for end in range(self.n_months):
+            yield end, self._range(codes, max(end - window + 1, 0), end + 1)
+
+    def rolling_top(self, n=10, window=3):
+        """Top `n` entities of each trailing `window`-month window.
+
+        Long frame of year_month (the last month of the window), rank, name and
+        hours_played.
+        """
+        rows = []
+        months = self._months()
+        for end, ms in self._windows(window):
+            played = np.flatnonzero(ms)
+            best = played[np.lexsort((played, -ms[played]))][:n]
+            rows.extend((months[end], rank, self.names[c], ms[c] / MS_PER_HOUR) for rank, c in enumerate(best, 1))
+        return pd.DataFrame(rows, columns=['year_month', 'rank', self.name, 'hours_played'])
+
+    def rank_over_time(self, entity, window=1):
+        """Rank of `entity` by hours in each trailing `window`-month window (NaN without plays)."""
+        code = self._codes[entity]
+        ranks = np.full(self.n_months, np.nan)
+        for end, ms in self._windows(window):
+            if ms[code]:
+                ranks[end] = 1 + np.count_nonzero(ms > ms[code])
+        return pd.Series(ranks, index=self._months(), name='rank')
+
+    def arrays(self, prefix):
+        return {f'{prefix}_names': np.array(json.dumps(self.names, ensure_ascii=False)),
+                f'{prefix}_months': np.array([self.first_month, self.n_months]),
+                f'{prefix}_keys': self.keys, f'{prefix}_cum': self.cum}
+
+    @classmethod
+    def from_arrays(cls, data, prefix, name):
+        first_month, n_months = (int(v) for v in data[f'{prefix}_months'])
+        return cls(name, json.loads(str(data[f'{prefix}_names'])), first_month, n_months,
+                   data[f'{prefix}_keys'], data[f'{prefix}_cum'])
+
+
+def build_cubes(df):
+    """Artist and track cubes of a frame loaded with time features."""
+    months = month_ordinal(df['year'].to_numpy(dtype=np.int64), df['month'].to_numpy(dtype=np.int64))
+    ms = df['ms_played'].to_numpy(dtype=np.int64, na_value=0)
+    cubes = {}
+    for entity, field in CUBE_ENTITIES.items():
+        codes, names = _codes(df[field])
+        cubes[entity] = EntityCube.build(field, np.asarray(codes, dtype=np.int64), names, months, ms)
+    return cubes
+
+
+def save_cubes(cubes, path):
+    arrays = {}
+    for entity, cube in cubes.items():
+        arrays.update(cube.arrays(entity))
+    np.savez_compressed(path, **arrays)
+
+
+def load_cubes(path):
+    with np.load(path) as data:
+        return {entity: EntityCube.from_arrays(data, entity, field) for entity, field in CUBE_ENTITIES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query artist x month and track x month cubes.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build the cubes of an export directory')
+    build.add_argument('json_dir')
+    build.add_argument('cube')
+    build.add_argument('--tz', help='timezone for calendar months (default: UTC)')
+    build.add_argument('--workers', type=int, default=1)
+    series = commands.add_parser('series', help='monthly hours of an artist or track')
+    series.add_argument('cube')
+    which = series.add_mutually_exclusive_group(required=True)
+    which.add_argument('--artist')
+    which.add_argument('--track')
+    for command in ('top', 'rolling'):
+        sub = commands.add_parser(command, help='top artists or tracks of a month range' if command == 'top'
+                                  else 'top artists or tracks of every trailing window')
+        sub.add_argument('cube')
+        sub.add_argument('--tracks', action='store_true', help='rank tracks instead of artists')
+        sub.add_argument('-n', type=int, default=10)
+        if command == 'top':
+            sub.add_argument('--start', help='first month, e.g. 2023-01')
+            sub.add_argument('--end', help='last month, included')
+        else:
+            sub.add_argument('--window', type=int, default=3, help='months per window')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        df = add_time_features(load_history(args.json_dir, AGGREGATE_FIELDS, args.workers), args.tz)
+        cubes = build_cubes(df)
+        save_cubes(cubes, args.cube)
+        print(', '.join(f'{len(cube.names)} {entity}' for entity, cube in cubes.items())
+              + f' over {cubes["artists"].n_months} months')
+        return
+    cubes = load_cubes(args.cube)
+    if args.command == 'series':
+        cube, name = (cubes['artists'], args.artist) if args.artist else (cubes['tracks'], args.track)
+        print(cube.series(name).to_string())
+        return
+    cube = cubes['tracks' if args.tracks else 'artists']
+    if args.command == 'top':
+        print(cube.top(args.n, args.start, args.end).to_string())
+    else:
+        print(cube.rolling_top(args.n, args.window).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,34 @@
-import pandas as pd
-import json
 import os
+import sys
+import webbrowser
 import matplotlib.pyplot as plt
 import seaborn as sns
+import numpy as np
 import plotly.express as px
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregate import aggregate
+from charts import batch_labels, heatmap
+from interactive import write_figure
+from loader import load_history, add_time_features
+
 # Load JSON files into a DataFrame
 json_dir = '/Users/roberto/OneDrive/Azure/Spotify/MyData2'
-dataframes = []
-
-for file in os.listdir(json_dir):
-    if file.endswith('.json'):
-        with open(os.path.join(json_dir, file), 'r') as f:
-            data = json.load(f)
-            dataframes.append(pd.DataFrame(data))
-
-df = pd.concat(dataframes, ignore_index=True)
 
-# Convert timestamp to datetime
-df['ts'] = pd.to_datetime(df['ts'])
+df = load_history(json_dir)  # Streams the json files into one dataframe
 
-# Extract time-based features
-df['hour'] = df['ts'].dt.hour
-df['day_of_week'] = df['ts'].dt.day_name()
-df['month'] = df['ts'].dt.month_name()
-df['year'] = df['ts'].dt.year
+# Extract time-based features and convert milliseconds to hours
+df = add_time_features(df)
 
-# Convert milliseconds to hours
-df['hours_played'] = df['ms_played'] / 3600000
+# All chart data in one pass over the play log
+agg = aggregate(df)
 
 # Set theme
 sns.set_theme(style="whitegrid")
 
 # Time series of total listening time
 plt.figure(figsize=(12, 6))
-df['year_month'] = df['ts'].dt.to_period('M')
-monthly_hours = df.groupby('year_month')['hours_played'].sum()
+monthly_hours = agg.monthly_hours()
 monthly_hours.plot(kind='line', marker='o', color='tab:blue', linewidth=2)
 plt.title('Monthly Listening Time', fontsize=16)
 plt.ylabel('Hours Played', fontsize=14)
@@ -47,8 +40,8 @@ plt.show()
 
 # Heatmap of listening hours vs. days of the week
 plt.figure(figsize=(14, 8))
-heatmap_data = df.groupby(['day_of_week', 'hour'])['hours_played'].sum().unstack()
-sns.heatmap(heatmap_data, cmap='coolwarm', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
+heatmap_data = agg.day_hour_hours()
+heatmap(plt.gca(), heatmap_data, cmap='coolwarm')
 plt.title('Listening Hours vs. Days of the Week', fontsize=16)
 plt.xlabel('Hour of the Day', fontsize=14)
 plt.ylabel('Day of the Week', fontsize=14)
@@ -57,12 +50,10 @@ plt.tight_layout()
 plt.show()
 
 # Heatmap of listening hours per month of the year
-month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-               'July', 'August', 'September', 'October', 'November', 'December']
-monthly_heatmap_data = df.groupby(['year', 'month'])['hours_played'].sum().unstack()[month_order]
+monthly_heatmap_data = agg.year_month_hours()
 
 plt.figure(figsize=(14, 8))
-sns.heatmap(monthly_heatmap_data, cmap='YlGnBu', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
+heatmap(plt.gca(), monthly_heatmap_data, cmap='YlGnBu')
 plt.title('Total Listening Hours per Month of the Year', fontsize=16)
 plt.xlabel('Month', fontsize=14)
 plt.ylabel('Year', fontsize=14)
@@ -71,34 +62,34 @@ plt.show()
 
 # Top 30 Tracks
 plt.figure(figsize=(12, 8))
-top_tracks = df.groupby('master_metadata_track_name')['hours_played'].sum().nlargest(30)
+top_tracks = agg.top_tracks(30)
 ax = top_tracks.plot(kind='barh', color='tab:blue')
 plt.title('Top 30 Tracks by Listening Time', fontsize=16)
 plt.xlabel('Hours Played', fontsize=14)
 plt.ylabel('Track Name', fontsize=14)
 
-for i, v in enumerate(top_tracks):
-    ax.text(v + 0.1, i, f"{v:.1f}", color='black', va='center')
+batch_labels(ax, top_tracks.to_numpy() + 0.1, np.arange(len(top_tracks)), [f"{v:.1f}" for v in top_tracks],
+             ha='left')
 
 plt.tight_layout()
 plt.show()
 
 # Top 50 Artists
 plt.figure(figsize=(12, 8))
-top_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(50)
+top_artists = agg.top_artists(50)
 ax = top_artists.plot(kind='barh', color='tab:green')
 plt.title('Top 50 Artists by Listening Time', fontsize=16)
 plt.xlabel('Hours Played', fontsize=14)
 plt.ylabel('Artist Name', fontsize=14)
 
-for i, v in enumerate(top_artists):
-    ax.text(v + 0.1, i, f"{v:.1f}", color='black', va='center')
+batch_labels(ax, top_artists.to_numpy() + 0.1, np.arange(len(top_artists)), [f"{v:.1f}" for v in top_artists],
+             ha='left')
 
 plt.tight_layout()
 plt.show()
 
 # Interactive Scatter Plot for Top 101 Artists
-top_101_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(101).reset_index()
+top_101_artists = agg.top_artists(101).reset_index()
 
 fig = px.scatter(
     top_101_artists,
@@ -110,7 +101,8 @@ fig = px.scatter(
     hover_data={'hours_played': ':.1f'},
     title='Top 101 Artists by Listening Time',
     labels={'hours_played': 'Hours Played', 'master_metadata_album_artist_name': 'Artist Name'},
-    color_continuous_scale='viridis'
+    color_continuous_scale='viridis',
+    render_mode='webgl'
 )
 
 fig.update_layout(
@@ -120,4 +112,5 @@ fig.update_layout(
     template='plotly_white'
 )
 
-fig.show()
\ No newline at end of file
+# Written next to a shared plotly.min.js instead of inlining plotly.js into the page
+webbrowser.open('file://' + os.path.abspath(write_figure(fig, 'charts', 'top_101_artists')))
\ No newline at end of file
@@ -1,41 +1,42 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import os
-import json
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregate import AGGREGATE_FIELDS, Aggregates, aggregate_by_year
+from loader import load_history, add_time_features
 
 # Load Data
 json_dir = '/Users/roberto/OneDrive/Azure/Spotify/MyData2' 
-dataframes = []
 
-for file in os.listdir(json_dir):
-    if file.endswith('.json'):
-        with open(os.path.join(json_dir, file), 'r') as f:
-            data = json.load(f)
-            dataframes.append(pd.DataFrame(data))
 
-df = pd.concat(dataframes, ignore_index=True)
-df['ts'] = pd.to_datetime(df['ts'])
-df['hours_played'] = df['ms_played'] / 3600000
+@st.cache_resource
+def load_yearly_aggregates(json_dir):
+    # Runs once per json_dir, not on every rerun: the play log is reduced to
+    # per-year totals and only those are kept.
+    df = add_time_features(load_history(json_dir, AGGREGATE_FIELDS))
+    return aggregate_by_year(df)
+
+
+yearly = load_yearly_aggregates(json_dir)
 
 # Streamlit App
 st.title("🎵 Spotify Streaming History Dashboard")
 st.sidebar.header("Filters")
 
 # Filter by Year
-year_filter = st.sidebar.multiselect("Select Year", df['ts'].dt.year.unique(), default=df['ts'].dt.year.unique())
-df_filtered = df[df['ts'].dt.year.isin(year_filter)]
+years = list(yearly)
+year_filter = st.sidebar.multiselect("Select Year", years, default=years)
+agg = sum((yearly[year] for year in year_filter), Aggregates.empty())
 
 # Top Artists Chart
-top_artists = df_filtered.groupby("master_metadata_album_artist_name")['hours_played'].sum().nlargest(10).reset_index()
+top_artists = agg.top_artists(10).reset_index()
 fig = px.bar(top_artists, x='hours_played', y='master_metadata_album_artist_name', orientation='h', title="Top 10 Artists")
 st.plotly_chart(fig)
 
 # Heatmap of Listening Patterns
 st.subheader("Listening Patterns Heatmap")
-df_filtered['hour'] = df_filtered['ts'].dt.hour
-df_filtered['day_of_week'] = df_filtered['ts'].dt.day_name()
-heatmap_data = df_filtered.pivot_table(index='day_of_week', columns='hour', values='hours_played', aggfunc='sum')
+heatmap_data = agg.day_hour_hours()
 
 st.write(px.imshow(heatmap_data, color_continuous_scale='viridis'))
-
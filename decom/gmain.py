@@ -1,41 +1,34 @@
-import pandas as pd
-import json
 import os
+import sys
+import webbrowser
 import matplotlib.pyplot as plt
 import seaborn as sns
 import mplcursors
+import numpy as np
 import plotly.express as px
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregate import aggregate
+from charts import batch_labels, heatmap
+from interactive import write_figure
+from loader import load_history, add_time_features
+
 # Load JSON files into a DataFrame
 json_dir = '/Users/roberto/OneDrive/Azure/Spotify/MyData2'
-dataframes = []
-
-for file in os.listdir(json_dir):
-    if file.endswith('.json'):
-        with open(os.path.join(json_dir, file), 'r') as f:
-            data = json.load(f)
-            dataframes.append(pd.DataFrame(data))
-
-df = pd.concat(dataframes, ignore_index=True)  # Combine JSONs into one DataFrame
 
-# Convert timestamp to datetime
-df['ts'] = pd.to_datetime(df['ts'])
+df = load_history(json_dir)  # Streams the json files into one dataframe
 
-# Extract time-based features
-df['hour'] = df['ts'].dt.hour
-df['day_of_week'] = df['ts'].dt.day_name()
-df['month'] = df['ts'].dt.month_name()
-df['year'] = df['ts'].dt.year
+# Extract time-based features and convert milliseconds to hours
+df = add_time_features(df)
 
-# Convert milliseconds to hours
-df['hours_played'] = df['ms_played'] / 3600000
+# All chart data in one pass over the play log
+agg = aggregate(df)
 
 ## --- IMPROVED VISUALIZATIONS ---
 
 # 1. Monthly Listening Time (Better Colors & Labels)
 plt.figure(figsize=(12, 6))
-df['year_month'] = df['ts'].dt.to_period('M')
-monthly_hours = df.groupby('year_month')['hours_played'].sum()
+monthly_hours = agg.monthly_hours()
 ax = monthly_hours.plot(kind='bar', width=0.85, cmap='plasma')
 
 plt.title('Monthly Listening Time', fontsize=14, fontweight='bold')
@@ -44,16 +37,16 @@ plt.xlabel('Month/Year', fontsize=12)
 ax.set_xticklabels([f"{x.month:02d}/{x.year % 100:02d}" for x in monthly_hours.index], rotation=90)
 
 # Add labels inside bars
-for i, (index, value) in enumerate(monthly_hours.items()):
-    plt.text(i, value + 1, f"{value:.1f}", ha='center', va='bottom', fontsize=10, color='black')
+batch_labels(ax, ax.get_xticks(), monthly_hours.to_numpy() + 1,
+             [f"{value:.1f}" for value in monthly_hours], size=10, va='bottom')
 
 plt.tight_layout()
 plt.show()
 
 # 2. Heatmap: Listening Hours vs. Days of the Week (Better Colors & Readability)
 plt.figure(figsize=(14, 8))
-heatmap_data = df.groupby(['day_of_week', 'hour'])['hours_played'].sum().unstack()
-sns.heatmap(heatmap_data, cmap='magma', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
+heatmap_data = agg.day_hour_hours()
+heatmap(plt.gca(), heatmap_data, cmap='magma')
 
 plt.title('Listening Hours vs. Days of the Week', fontsize=14, fontweight='bold')
 plt.xlabel('Hour of the Day', fontsize=12)
@@ -64,7 +57,7 @@ plt.tight_layout()
 plt.show()
 
 # 3. Top 30 Tracks (Better Bar Plot)
-top_tracks = df.groupby('master_metadata_track_name')['hours_played'].sum().nlargest(30)
+top_tracks = agg.top_tracks(30)
 plt.figure(figsize=(12, 8))
 sns.barplot(y=top_tracks.index, x=top_tracks.values, palette="coolwarm")
 plt.title('Top 30 Tracks by Listening Time', fontsize=14, fontweight='bold')
@@ -76,7 +69,7 @@ plt.tight_layout()
 plt.show()
 
 # 4. Top Artists (Using Plotly for Interactivity)
-top_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(50).reset_index()
+top_artists = agg.top_artists(50).reset_index()
 
 fig = px.bar(top_artists, 
              x="hours_played", 
@@ -87,10 +80,10 @@ fig = px.bar(top_artists,
              color_continuous_scale='viridis')
 
 fig.update_layout(xaxis_title="Hours Played", yaxis_title="Artist", height=800)
-fig.show()
+webbrowser.open('file://' + os.path.abspath(write_figure(fig, 'charts', 'top_artists')))
 
 # 5. Scatter Plot of Top 50 Artists (Better Aesthetics)
-top_50_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(50).reset_index()
+top_50_artists = top_artists
 
 plt.figure(figsize=(12, 8))
 scatter = plt.scatter(
@@ -105,11 +98,11 @@ scatter = plt.scatter(
 )
 
 # Add artist names next to markers
-for i in range(len(top_50_artists)):
-    plt.text(top_50_artists['hours_played'][i], 
-             len(top_50_artists) - 1 - i, 
-             top_50_artists['master_metadata_album_artist_name'][i], 
-             fontsize=10, ha='right' if i % 2 == 0 else 'left', color='white')
+names = top_50_artists['master_metadata_album_artist_name'].astype(str).tolist()
+hours = top_50_artists['hours_played'].to_numpy()
+rows = len(names) - 1 - np.arange(len(names))
+batch_labels(plt.gca(), hours[::2], rows[::2], names[::2], size=10, ha='right', va='bottom', color='white')
+batch_labels(plt.gca(), hours[1::2], rows[1::2], names[1::2], size=10, ha='left', va='bottom', color='white')
 
 plt.colorbar(scatter, label='Hours Played')
 plt.title('Top 50 Artists by Listening Time', fontsize=14, fontweight='bold')
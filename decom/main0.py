@@ -1,39 +1,28 @@
-import pandas as pd
-import json
 import os
+import sys
 import matplotlib.pyplot as plt
-import seaborn as sns
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregate import aggregate
+from charts import batch_labels, heatmap
+from loader import load_history, add_time_features
 
 # Load JSON files into a DataFrame
 json_dir = '/Users/roberto/OneDrive/Azure/Spotify/MyData2'
-dataframes = []
-
-for file in os.listdir(json_dir):
-    if file.endswith('.json'):
-        with open(os.path.join(json_dir, file), 'r') as f:
-            data = json.load(f)
-            dataframes.append(pd.DataFrame(data))
-
-df = pd.concat(dataframes, ignore_index=True) # One large dataframe creation from json files
 
-# Convert timestamp to datetime
-df['ts'] = pd.to_datetime(df['ts'])
+df = load_history(json_dir)  # Streams the json files into one dataframe
 
-# Extract time-based features
-df['hour'] = df['ts'].dt.hour
-df['day_of_week'] = df['ts'].dt.day_name()
-df['month'] = df['ts'].dt.month_name()
-df['year'] = df['ts'].dt.year
+# Extract time-based features and convert milliseconds to hours
+df = add_time_features(df)
 
-# Convert milliseconds to hours
-df['hours_played'] = df['ms_played'] / 3600000
+# All chart data in one pass over the play log
+agg = aggregate(df)
 
 ## Visualizations
 
 # Time series of total listening time
 plt.figure(figsize=(12, 6))
-df['year_month'] = df['ts'].dt.to_period('M')
-monthly_hours = df.groupby('year_month')['hours_played'].sum()
+monthly_hours = agg.monthly_hours()
 ax = monthly_hours.plot(kind='bar', width=0.8, color=monthly_hours.index.year.map(lambda x: plt.cm.tab20(x % 20)))
 plt.title('Monthly Listening Time')
 plt.ylabel('Hours Played')
@@ -41,18 +30,18 @@ plt.xlabel('Month/Year')
 ax.set_xticklabels([f"{x.month:02d}/{x.year % 100:02d}" for x in monthly_hours.index], rotation=90)
 
 # Add labels inside the bars
-for i, (index, value) in enumerate(monthly_hours.items()):
-    position = 'top' if i % 2 == 0 else 'bottom'
-    y = value + 0.5 if position == 'top' else value - 0.5
-    ax.text(i, y, f"{value:.1f}", ha='center', va=position, color='black')
+labels = [f"{value:.1f}" for value in monthly_hours]
+positions = ax.get_xticks()
+batch_labels(ax, positions[::2], monthly_hours.to_numpy()[::2] + 0.5, labels[::2], va='top')
+batch_labels(ax, positions[1::2], monthly_hours.to_numpy()[1::2] - 0.5, labels[1::2], va='bottom')
 
 plt.tight_layout()
 plt.show()
 
 # Heatmap of listening hours vs. days of the week
 plt.figure(figsize=(14, 8))
-heatmap_data = df.groupby(['day_of_week', 'hour'])['hours_played'].sum().unstack()
-sns.heatmap(heatmap_data, cmap='viridis', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
+heatmap_data = agg.day_hour_hours()
+heatmap(plt.gca(), heatmap_data, cmap='viridis')
 plt.title('Listening Hours vs. Days of the Week')
 plt.xlabel('Hour of the Day')
 plt.ylabel('Day of the Week')
@@ -61,8 +50,8 @@ plt.show()
 
 # Heatmap of listening hours per month of the year
 plt.figure(figsize=(14, 8))
-monthly_heatmap_data = df.groupby(['year', 'month'])['hours_played'].sum().unstack()
-sns.heatmap(monthly_heatmap_data, cmap='viridis', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
+monthly_heatmap_data = agg.year_month_hours()
+heatmap(plt.gca(), monthly_heatmap_data, cmap='viridis')
 plt.title('Total Listening Hours per Month of the Year')
 plt.xlabel('Month')
 plt.ylabel('Year')
@@ -72,7 +61,7 @@ plt.show()
 ## Data Analysis
 # Top 30 tracks
 plt.figure(figsize=(12, 6))
-top_tracks = df.groupby('master_metadata_track_name')['hours_played'].sum().nlargest(30)
+top_tracks = agg.top_tracks(30)
 top_tracks.plot(kind='bar', title='Top 10 Tracks by Listening Time')
 plt.ylabel('Hours Played')
 plt.xlabel('Track Name')
@@ -82,7 +71,7 @@ plt.show()
 
 # Top 10 artists by listening time  
 plt.figure(figsize=(12, 6))
-top_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(50)
+top_artists = agg.top_artists(50)
 top_artists.plot(kind='bar', title='Top Artists by Listening Time')
 plt.ylabel('Hours Played')
 plt.xlabel('Artist Name')
@@ -0,0 +1,220 @@
+"""Drop plays that appear in more than one export file.
+
+A re-requested export repeats the plays of earlier ones. Every play gets a
+64-bit key hashed from its timestamp, URI (track, episode or audiobook
+chapter) and ms_played, and a play is dropped when its key was already seen,
+earlier in the same file or in a file ingested before.
+
+The state directory keeps the sorted keys of every kept play (8 bytes per
+play) and, per file, its keys and keep mask. Files are owned in the order
+they were first ingested: a new export only loses the plays that older ones
+already hold, and nothing has to be hashed again for files seen before. When
+a file changes or disappears, the index is rebuilt from the stored keys.
+
+load_deduplicated() applies the keep masks to a full load, and
+rollups.update_rollups(..., dedup_dir=) to the per-file rollups (and so to
+watch.py and `cli.py aggregate --rollup-dir`). The columnar cache and the
+chunked backend do not apply them.
+
+    python dedup.py /path/to/MyData /path/to/dedup-state
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cache import fingerprint, is_fresh, read_manifest, write_manifest
+from loader import concat_frames, epoch_seconds, history_files, read_file, read_history
+
+DEDUP_VERSION = 1
+INDEX = 'index.npy'
+URI_FIELDS = ['spotify_track_uri', 'spotify_episode_uri', 'audiobook_chapter_uri']
+KEY_FIELDS = ['ts', 'ms_played'] + URI_FIELDS
+
+
+def _schema():
+    return {'version': DEDUP_VERSION, 'key': KEY_FIELDS}
+
+
+def _mix(x):
+    # splitmix64 finalizer; uint64 arithmetic wraps around.
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _string_hashes(values):
+    return np.array([int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'little')
+                     for value in values], dtype=np.uint64)
+
+
+def play_keys(frame):
+    """64-bit (ts, URI, ms_played) keys of the plays in `frame`."""
+    # The first URI a play has; plays without one hash to 0.
+    uri_hash = np.zeros(len(frame), dtype=np.uint64)
+    found = np.zeros(len(frame), dtype=bool)
+    for field in URI_FIELDS:
+        codes, uniques = frame[field].factorize()
+        use = (codes >= 0) & ~found
+        uri_hash[use] = _string_hashes(uniques)[codes[use]]
+        found |= use
+    ts = epoch_seconds(frame['ts']).view(np.uint64)
+    ms = frame['ms_played'].to_numpy(dtype=np.int64, na_value=-1).view(np.uint64)
+    return _mix(_mix(_mix(ts) ^ uri_hash) ^ ms)
+
+
+def _contains(index, keys):
+    if not len(index):
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(index, keys), len(index) - 1)
+    return index[pos] == keys
+
+
+def keep_mask(keys, index):
+    """True for the first play of every key that is not in the sorted `index`."""
+    keep = np.zeros(len(keys), dtype=bool)
+    keep[np.unique(keys, return_index=True)[1]] = True
+    return keep & ~_contains(index, keys)
+
+
+class DedupIndex:
+    """The persisted keys of every kept play and the files they came from."""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.files = read_manifest(state_dir, _schema())
+        index_path = os.path.join(state_dir, INDEX)
+        if self.files and os.path.exists(index_path):
+            self.index = np.load(index_path)
+        else:
+            self.files = {}
+            self.index = np.zeros(0, dtype=np.uint64)
+
+    def _part(self, name):
+        return os.path.join(self.state_dir, self.files[name]['part'])
+
+    def _read_part(self, name):
+        with np.load(self._part(name)) as part:
+            keys = part['keys']
+            return keys, np.unpackbits(part['keep'], count=len(keys)).astype(bool)
+
+    def _write_part(self, name, keys, keep):
+        np.savez(self._part(name), keys=keys, keep=np.packbits(keep))
+        self.files[name]['dropped'] = int(len(keep) - keep.sum())
+
+    def forget(self, names):
+        """Remove files from the index and recompute which plays the rest keep."""
+        if not names:
+            return
+        for name in names:
+            os.remove(self._part(name))
+            del self.files[name]
+        self.index = np.zeros(0, dtype=np.uint64)
+        for name in sorted(self.files, key=lambda name: self.files[name]['seq']):
+            keys, _ = self._read_part(name)
+            keep = keep_mask(keys, self.index)
+            self.index = np.union1d(self.index, keys[keep])
+            self._write_part(name, keys, keep)
+
+    def add(self, path, keys):
+        """Ingest a new file's keys and return its keep mask."""
+        name = os.path.basename(path)
+        seq = max((entry['seq'] for entry in self.files.values()), default=-1) + 1
+        part = hashlib.sha1(name.encode()).hexdigest()[:16] + '.npz'
+        self.files[name] = dict(fingerprint(path), part=part, seq=seq, rows=len(keys))
+        keep = keep_mask(keys, self.index)
+        self.index = np.union1d(self.index, keys[keep])
+        self._write_part(name, keys, keep)
+        return keep
+
+    def keep(self, name):
+        return self._read_part(name)[1]
+
+    def save(self):
+        np.save(os.path.join(self.state_dir, INDEX), self.index)
+        write_manifest(self.state_dir, _schema(), self.files)
+
+
+def mask_digest(keep):
+    """Short hash of a keep mask, to tell whether a file's kept plays changed."""
+    return hashlib.sha1(np.packbits(keep).tobytes() + len(keep).to_bytes(8, 'little')).hexdigest()[:16]
+
+
+def file_keys(path):
+    """Keys of the plays in one export file, reading only the key fields."""
+    return play_keys(read_file(path, KEY_FIELDS))
+
+
+def read_kept(path, fields, keep):
+    """Load one export file without the plays its keep mask drops."""
+    return read_file(path, fields)[keep].reset_index(drop=True)
+
+
+def _map(fn, workers, *args):
+    n = len(args[0])
+    workers = min(workers or os.cpu_count(), n)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, *args))
+    return [fn(*call) for call in zip(*args)]
+
+
+def update_index(json_dir, state_dir, workers=1):
+    """Bring the index in `state_dir` up to date with the files in `json_dir`.
+
+    Files that changed or disappeared are forgotten and new files are hashed
+    (only their key fields are read) and ingested in file order. Returns the
+    index and the paths of the files in `json_dir`.
+    """
+    paths = history_files(json_dir)
+    names = [os.path.basename(path) for path in paths]
+    index = DedupIndex(state_dir)
+    index.forget([name for name, entry in index.files.items()
+                  if name not in names or not is_fresh(entry, paths[names.index(name)])])
+    new = [path for path, name in zip(paths, names) if name not in index.files]
+    for path, keys in zip(new, _map(file_keys, workers, new)):
+        index.add(path, keys)
+    index.save()
+    return index, paths
+
+
+def keep_masks(json_dir, state_dir, workers=1):
+    """{file name: keep mask} of the files in `json_dir`, updating the index first."""
+    index, paths = update_index(json_dir, state_dir, workers)
+    return {os.path.basename(path): index.keep(os.path.basename(path)) for path in paths}
+
+
+def load_deduplicated(json_dir, state_dir, fields=None, workers=1):
+    """Load `json_dir` like load_history(), without plays seen before.
+
+    Each file is filtered by its keep mask as soon as it is parsed (in the
+    worker), so only the kept plays are held until they are concatenated.
+    Returns the frame and {file name: plays dropped} for the files in
+    `json_dir`.
+    """
+    index, paths = update_index(json_dir, state_dir, workers)
+    names = [os.path.basename(path) for path in paths]
+    frames = _map(read_kept, workers, paths, [fields] * len(paths), [index.keep(name) for name in names])
+    df = concat_frames(frames) if frames else read_history([], fields)
+    return df, {name: index.files[name]['dropped'] for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the plays repeated across overlapping export files.')
+    parser.add_argument('json_dir')
+    parser.add_argument('state_dir')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    index, paths = update_index(args.json_dir, args.state_dir, args.workers)
+    entries = [index.files[os.path.basename(path)] for path in paths]
+    for path, entry in zip(paths, entries):
+        print(f'{os.path.basename(path)}: {entry["dropped"]} duplicate plays dropped')
+    dropped = sum(entry['dropped'] for entry in entries)
+    print(f'{sum(entry["rows"] for entry in entries) - dropped} distinct plays, {dropped} duplicates')
+
+
+if __name__ == '__main__':
+    main()
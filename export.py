@@ -0,0 +1,108 @@
+"""Per-artist listening history files for every artist at once.
+
+Each file has the format of Tchaikovsky_listening_history.csv: the artist's
+tracks in name order with their total hours played. All artists come out of
+one grouped pass over (artist, track), and the files are written from a pool
+of threads. With `single`, everything goes to one file with an Artist column
+instead, sorted by artist.
+
+    python export.py /path/to/MyData exports/ --top 50
+    python export.py /path/to/MyData --single artist_tracks.parquet
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from aggregate import ARTIST, MS_PER_HOUR, TRACK
+from loader import load_history
+
+EXPORT_FIELDS = ['ms_played', TRACK, ARTIST]
+# Characters that cannot appear in file names on Windows or macOS.
+_UNSAFE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def artist_track_hours(df, top=None):
+    """Frame of Artist, Track and Hours Played, sorted by artist and track.
+
+    With `top`, only the `top` artists with the most hours are included.
+    """
+    ms = (df.groupby([ARTIST, TRACK], observed=True, sort=False)['ms_played']
+          .sum().astype('int64').rename('ms').reset_index())
+    if top is not None:
+        artist_ms = ms.groupby(ARTIST, observed=True)['ms'].sum()
+        ms = ms[ms[ARTIST].isin(artist_ms.nlargest(top).index)]
+    table = pd.DataFrame({
+        'Artist': ms[ARTIST].astype(str).to_numpy(),
+        'Track': ms[TRACK].astype(str).to_numpy(),
+        'Hours Played': (ms['ms'] / MS_PER_HOUR).to_numpy(),
+    })
+    return table.sort_values(['Artist', 'Track'], ignore_index=True)
+
+
+def file_name(artist, taken):
+    """`<artist>_listening_history.csv`, made safe and unique within `taken`."""
+    base = _UNSAFE.sub('_', artist).strip(' .') or '_'
+    name = f'{base}_listening_history.csv'
+    i = 1
+    while name.lower() in taken:
+        i += 1
+        name = f'{base}_{i}_listening_history.csv'
+    taken.add(name.lower())
+    return name
+
+
+def _write_csv(table, path):
+    table.to_csv(path, index=False)
+    return path
+
+
+def export_artists(table, out_dir, jobs=4):
+    """Write one CSV per artist of `table` to `out_dir`; return the paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    taken = set()
+    jobs_args = []
+    bounds = table['Artist'].ne(table['Artist'].shift()).to_numpy().nonzero()[0].tolist() + [len(table)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        artist = table['Artist'].iat[start]
+        part = table.iloc[start:stop, 1:]
+        jobs_args.append((part, os.path.join(out_dir, file_name(artist, taken))))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(lambda args: _write_csv(*args), jobs_args))
+
+
+def export_single(table, path):
+    """Write all artists to one .csv or .parquet file at `path`."""
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export track hours of every artist, one CSV per artist.')
+    parser.add_argument('json_dir')
+    parser.add_argument('out_dir', nargs='?', help='directory for the per-artist CSV files')
+    parser.add_argument('--single', metavar='PATH',
+                        help='write one .csv or .parquet file with an Artist column instead')
+    parser.add_argument('--top', type=int, help='only the artists with the most hours')
+    parser.add_argument('--workers', type=int, default=1, help='processes used to parse the export files')
+    parser.add_argument('--jobs', type=int, default=4, help='threads writing the per-artist files')
+    args = parser.parse_args()
+    if not (args.out_dir or args.single):
+        parser.error('give an output directory or --single PATH')
+
+    table = artist_track_hours(load_history(args.json_dir, EXPORT_FIELDS, args.workers), args.top)
+    if args.single:
+        export_single(table, args.single)
+        print(f"wrote {table['Artist'].nunique()} artists to {args.single}")
+    if args.out_dir:
+        paths = export_artists(table, args.out_dir, args.jobs)
+        print(f'wrote {len(paths)} files to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
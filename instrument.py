@@ -0,0 +1,134 @@
+"""Stage timers and memory tracking for the analysis pipeline.
+
+Pipeline code marks its steps with `with stage('load.parse'):`. This costs
+nothing unless a Profiler is active; when one is, every stage records wall
+time, CPU time, max RSS and (optionally) the tracemalloc peak, and the
+profiler can write them as a JSON report and dump cProfile statistics.
+
+    with Profiler(trace_memory=True, cprofile='run.prof') as profiler:
+        ...
+    profiler.write('report.json')
+"""
+import cProfile
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+_active = None
+
+
+def active():
+    """The Profiler currently collecting stages, or None."""
+    return _active
+
+
+def stage(name):
+    """Context manager timing `name` on the active profiler, if any."""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name)
+
+
+def max_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (2**20 if platform.system() == 'Darwin' else 2**10)
+
+
+class Profiler:
+    """Collects the stages run while it is active."""
+
+    def __init__(self, trace_memory=False, cprofile=None):
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        self.stages = []
+        self._stack = []
+        self._previous = None
+        self._tracing = False
+        self._profile = None
+        self._started = None
+        self.total_wall_s = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        self._started = (datetime.now(timezone.utc), time.perf_counter())
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self.total_wall_s = time.perf_counter() - self._started[1]
+        _active = self._previous
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        frame = {'peak': 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the peak reached so far by the enclosing stages before resetting it.
+            for outer in self._stack:
+                outer['peak'] = max(outer['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['peak'] = current
+        entry = {'stage': name, 'depth': len(self._stack)}
+        self.stages.append(entry)
+        self._stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry['wall_s'] = time.perf_counter() - wall
+            entry['cpu_s'] = time.process_time() - cpu
+            entry['max_rss_mb'] = max_rss_mb()
+            self._stack.pop()
+            if self.trace_memory:
+                frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                for outer in self._stack:
+                    outer['peak'] = max(outer['peak'], frame['peak'])
+                entry['peak_traced_mb'] = frame['peak'] / 2**20
+
+    def extend(self, stages):
+        """Add stages measured elsewhere, e.g. returned by a worker process."""
+        depth = len(self._stack)
+        for entry in stages:
+            self.stages.append(dict(entry, depth=depth + entry['depth']))
+
+    def report(self):
+        return {
+            'command': sys.argv,
+            'started': self._started[0].isoformat(timespec='seconds') if self._started else None,
+            'total_wall_s': self.total_wall_s,
+            'trace_memory': self.trace_memory,
+            'stages': self.stages,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def summary(self):
+        """The stages as indented text lines."""
+        lines = []
+        for entry in self.stages:
+            memory = f"  {entry['peak_traced_mb']:8.1f} MB peak" if 'peak_traced_mb' in entry else ''
+            name = '  ' * entry['depth'] + entry['stage']
+            lines.append(f"{name:<40} {entry.get('wall_s', 0):8.3f} s wall {entry.get('cpu_s', 0):8.3f} s cpu{memory}")
+        return lines
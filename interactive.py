@@ -0,0 +1,143 @@
+"""Interactive HTML versions of the charts, drawn with plotly.
+
+Each page holds only its chart's (aggregated) data and loads plotly.js from a
+plotly.min.js written once next to the pages, instead of inlining the
+multi-megabyte bundle into every page or fetching it from a CDN. Scatter
+charts use WebGL traces (scattergl), which stay responsive with thousands of
+points, and value labels are per-trace text arrays rather than one
+annotation per bar or cell.
+
+    python main.py --json-dir /path/to/MyData --out charts/ --formats png html
+"""
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+from plotly.colors import qualitative
+from plotly.offline import get_plotlyjs
+
+PLOTLY_JS = 'plotly.min.js'
+LAYOUT = {'template': 'plotly_white'}
+
+
+def write_plotly_js(out_dir):
+    """Write the plotly.js bundle the pages in `out_dir` load, unless it is already there."""
+    path = os.path.join(out_dir, PLOTLY_JS)
+    bundle = get_plotlyjs()
+    if not os.path.exists(path) or os.path.getsize(path) != len(bundle.encode()):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(bundle)
+        os.replace(tmp, path)
+    return path
+
+
+def _save(fig, out_dir, name):
+    path = os.path.join(out_dir, f'{name}.html')
+    fig.write_html(path, include_plotlyjs=PLOTLY_JS, full_html=True, config={'displaylogo': False})
+    return path
+
+
+def write_figure(fig, out_dir, name):
+    """Save any plotly `fig` as `out_dir`/`name`.html, loading the shared plotly.min.js."""
+    os.makedirs(out_dir, exist_ok=True)
+    write_plotly_js(out_dir)
+    return _save(fig, out_dir, name)
+
+
+def figure_monthly_hours(monthly_hours):
+    colors = [qualitative.Plotly[year % len(qualitative.Plotly)] for year in monthly_hours.index.year]
+    fig = go.Figure(go.Bar(x=[f'{m.month:02d}/{m.year % 100:02d}' for m in monthly_hours.index],
+                           y=monthly_hours.to_numpy(), marker_color=colors,
+                           texttemplate='%{y:.1f}', textposition='outside'))
+    fig.update_layout(title='Monthly Listening Time', xaxis_title='Month/Year', yaxis_title='Hours Played',
+                      xaxis_type='category', **LAYOUT)
+    return fig
+
+
+def _heatmap(frame, title, x_title, y_title):
+    values = frame.to_numpy(dtype=float)
+    fig = go.Figure(go.Heatmap(z=np.where(np.isfinite(values), values, None),
+                               x=[str(c) for c in frame.columns], y=[str(r) for r in frame.index],
+                               colorscale='Viridis', colorbar_title='Hours Played',
+                               texttemplate='%{z:.1f}', hovertemplate='%{y} %{x}: %{z:.1f} h<extra></extra>'))
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title=y_title, yaxis_autorange='reversed',
+                      xaxis_type='category', yaxis_type='category', **LAYOUT)
+    return fig
+
+
+def figure_day_hour_heatmap(heatmap_data):
+    return _heatmap(heatmap_data, 'Listening Hours vs. Days of the Week', 'Hour of the Day', 'Day of the Week')
+
+
+def figure_year_month_heatmap(monthly_heatmap_data):
+    return _heatmap(monthly_heatmap_data, 'Total Listening Hours per Month of the Year', 'Month', 'Year')
+
+
+def _bars(top, title, x_title):
+    fig = go.Figure(go.Bar(x=[str(name) for name in top.index], y=top.to_numpy(),
+                           hovertemplate='%{x}: %{y:.1f} h<extra></extra>'))
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title='Hours Played', xaxis_type='category',
+                      **LAYOUT)
+    return fig
+
+
+def figure_top_tracks(top_tracks):
+    return _bars(top_tracks, f'Top {len(top_tracks)} Tracks by Listening Time', 'Track Name')
+
+
+def figure_top_artists(top_artists):
+    return _bars(top_artists, 'Top Artists by Listening Time', 'Artist Name')
+
+
+def figure_top_artists_scatter(top_artists):
+    hours = top_artists.to_numpy()
+    fig = go.Figure(go.Scattergl(
+        x=hours, y=[str(name) for name in top_artists.index], mode='markers',
+        marker={'size': 6 + 24 * np.sqrt(hours / (hours.max(initial=0) or 1)), 'symbol': 'square',
+                'color': hours, 'colorscale': 'Viridis', 'opacity': 0.6, 'showscale': True,
+                'colorbar': {'title': 'Hours Played'}},
+        hovertemplate='%{y}: %{x:.1f} h<extra></extra>'))
+    fig.update_layout(title=f'Top {len(top_artists)} Artists by Listening Time', xaxis_title='Hours Played',
+                      yaxis_title='Artist Name', yaxis_autorange='reversed', yaxis_type='category',
+                      height=max(500, 16 * len(top_artists)), **LAYOUT)
+    return fig
+
+
+def figure_content_pie(content_type):
+    fig = go.Figure(go.Pie(labels=[str(label) for label in content_type.index], values=content_type.to_numpy(),
+                           texttemplate='%{percent:.1%}'))
+    fig.update_layout(title='Podcast vs. Music Listening Time', **LAYOUT)
+    return fig
+
+
+def figure_top_shows(top_podcasts):
+    return _bars(top_podcasts, f'Top {len(top_podcasts)} Podcast Shows', 'Podcast Show')
+
+
+# chart name (as in charts.CHARTS) -> figure of its data
+FIGURES = {
+    'monthly_hours': figure_monthly_hours,
+    'day_hour_heatmap': figure_day_hour_heatmap,
+    'year_month_heatmap': figure_year_month_heatmap,
+    'top_tracks': figure_top_tracks,
+    'top_artists': figure_top_artists,
+    'top_artists_scatter': figure_top_artists_scatter,
+    'content_pie': figure_content_pie,
+    'top_shows': figure_top_shows,
+}
+
+
+def write_html(name, data, out_dir):
+    """Save chart `name` of `data` as `out_dir`/`name`.html.
+
+    Expects plotly.min.js to be in `out_dir` already (see write_plotly_js()).
+    """
+    from charts import has_data
+    if has_data(data):
+        fig = FIGURES[name](data)
+    else:
+        fig = go.Figure()
+        fig.update_layout(title=name.replace('_', ' ').capitalize(), xaxis_visible=False, yaxis_visible=False,
+                          annotations=[{'text': 'No data', 'showarrow': False, 'font_size': 16}], **LAYOUT)
+    return _save(fig, out_dir, name)
@@ -0,0 +1,448 @@
+"""Shared loader for Spotify extended streaming history exports.
+
+Records are streamed out of each JSON array one object at a time and appended
+to typed column buffers, so the full list of Python dicts and the per-file
+DataFrames never exist at the same time. Strings come out as categoricals and
+integers in the narrowest type that holds them.
+
+`json_dir` may also be the export's .zip archive: its Streaming_History*.json
+members are then decompressed straight into the parser, and every other
+member is skipped. Members are named '<archive>.zip/<member>' wherever a
+file path is expected.
+"""
+import io
+import json
+import os
+import posixpath
+import re
+import zipfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrument import stage
+
+CHUNK_SIZE = 1 << 20  # characters read from an export file per refill
+CHUNK_ROWS = 500000  # plays per frame yielded by iter_frames
+TS_WIDTH = len('2024-01-01T00:00:00Z')
+
+# Column kinds of the extended streaming history export. Fields that are not
+# listed here are ignored.
+FIELDS = {
+    'ts': 'ts',
+    'username': 'str',
+    'platform': 'str',
+    'ms_played': 'uint32',
+    'conn_country': 'str',
+    'ip_addr': 'str',
+    'ip_addr_decrypted': 'str',
+    'user_agent_decrypted': 'str',
+    'master_metadata_track_name': 'str',
+    'master_metadata_album_artist_name': 'str',
+    'master_metadata_album_album_name': 'str',
+    'spotify_track_uri': 'str',
+    'episode_name': 'str',
+    'episode_show_name': 'str',
+    'spotify_episode_uri': 'str',
+    'audiobook_title': 'str',
+    'audiobook_uri': 'str',
+    'audiobook_chapter_uri': 'str',
+    'audiobook_chapter_title': 'str',
+    'reason_start': 'str',
+    'reason_end': 'str',
+    'shuffle': 'bool',
+    'skipped': 'bool',
+    'offline': 'bool',
+    'offline_timestamp': 'int64',
+    'incognito_mode': 'bool',
+}
+
+# Identifying or unused fields that are only loaded when asked for by name.
+OPTIONAL_FIELDS = {
+    'ip_addr', 'ip_addr_decrypted', 'user_agent_decrypted',
+    'spotify_track_uri', 'spotify_episode_uri', 'audiobook_uri', 'audiobook_chapter_uri',
+}
+DEFAULT_FIELDS = [name for name in FIELDS if name not in OPTIONAL_FIELDS]
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+_SKIP = re.compile(r'[\s,]*')
+_ZIP_MEMBER = re.compile(r'(.*?\.zip)/(.+)$', re.IGNORECASE)
+# Positions of the separators and digits in a 'YYYY-MM-DDTHH:MM:SSZ' timestamp.
+_TS_SEPARATORS = {4: ord('-'), 7: ord('-'), 10: ord('T'), 13: ord(':'), 16: ord(':'), 19: ord('Z')}
+_TS_DIGITS = [i for i in range(TS_WIDTH) if i not in _TS_SEPARATORS]
+
+
+def days_from_civil(year, month, day):
+    """Days since 1970-01-01 of proleptic Gregorian dates, on integer arrays."""
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def civil_from_days(days):
+    """Inverse of days_from_civil: (year, month, day) arrays."""
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    return yoe + era * 400 + (month <= 2), month, day
+
+
+def parse_timestamps(raw):
+    """Epoch seconds (int64) of a buffer of packed 'YYYY-MM-DDTHH:MM:SSZ' values.
+
+    Works on the digits as small integers, which is much faster than
+    pd.to_datetime on strings and needs no per-row Python objects.
+    """
+    chars = np.frombuffer(raw, dtype=np.uint8).reshape(-1, TS_WIDTH)
+    bad = np.zeros(len(chars), dtype=bool)
+    for i, sep in _TS_SEPARATORS.items():
+        bad |= chars[:, i] != sep
+    for i in _TS_DIGITS:
+        bad |= (chars[:, i] < ord('0')) | (chars[:, i] > ord('9'))
+    if bad.any():
+        value = bytes(chars[np.argmax(bad)]).decode('ascii', 'replace')
+        raise ValueError(f'unexpected timestamp {value!r}')
+
+    def number(start, stop):
+        value = np.zeros(len(chars), dtype=np.int64)
+        for i in range(start, stop):
+            value = value * 10 + (chars[:, i] - ord('0'))
+        return value
+
+    days = days_from_civil(number(0, 4), number(5, 7), number(8, 10))
+    return days * 86400 + number(11, 13) * 3600 + number(14, 16) * 60 + number(17, 19)
+
+
+def _zip_member(path):
+    """(archive, member) if `path` names a member of a .zip export, else None."""
+    match = _ZIP_MEMBER.match(path)
+    if match is None or not os.path.isfile(match.group(1)):
+        return None
+    return match.group(1), match.group(2)
+
+
+def history_files(json_dir):
+    """Return the export files in `json_dir`, sorted so row order is stable.
+
+    For a .zip archive these are its Streaming_History*.json members.
+    """
+    if os.path.isfile(json_dir) and zipfile.is_zipfile(json_dir):
+        with zipfile.ZipFile(json_dir) as archive:
+            members = [name for name in archive.namelist()
+                       if posixpath.basename(name).startswith('Streaming_History') and name.endswith('.json')]
+        return [f'{json_dir}/{name}' for name in sorted(members)]
+    return [os.path.join(json_dir, name) for name in sorted(os.listdir(json_dir))
+            if name.endswith('.json')]
+
+
+def open_export(path, binary=False):
+    """Open an export file, or stream-decompress a member of a .zip export."""
+    member = _zip_member(path)
+    if member is None:
+        return open(path, 'rb') if binary else open(path, 'r', encoding='utf-8-sig')
+    # The member keeps the archive file open after the ZipFile is closed.
+    with zipfile.ZipFile(member[0]) as archive:
+        f = archive.open(member[1])
+    return f if binary else io.TextIOWrapper(f, encoding='utf-8-sig')
+
+
+def export_stat(path):
+    """(size, mtime_ns) of an export file; a .zip member has the archive's mtime."""
+    member = _zip_member(path)
+    if member is None:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    with zipfile.ZipFile(member[0]) as archive:
+        size = archive.getinfo(member[1]).file_size
+    return size, os.stat(member[0]).st_mtime_ns
+
+
+def iter_records(f, chunk_size=CHUNK_SIZE):
+    """Yield the play records of an export file object one at a time.
+
+    Only `chunk_size` characters plus the record being decoded are held in
+    memory, regardless of how large the JSON array is.
+    """
+    decode = json.JSONDecoder().raw_decode
+    buf = f.read(chunk_size)
+    pos = _SKIP.match(buf).end()
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('export file does not contain a JSON array')
+    pos += 1
+    eof = False
+    while True:
+        pos = _SKIP.match(buf, pos).end()
+        if pos < len(buf):
+            if buf[pos] == ']':
+                return
+            try:
+                record, pos = decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield record
+                continue
+        elif eof:
+            raise ValueError('unterminated JSON array in export file')
+        # The next record is cut off by the end of the buffer.
+        chunk = f.read(chunk_size)
+        buf = buf[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+
+def field_kinds(fields=None):
+    """Map the requested field names to their kinds.
+
+    `fields` is None for DEFAULT_FIELDS, 'all' for every known field, or an
+    iterable of field names.
+    """
+    if fields is None:
+        fields = DEFAULT_FIELDS
+    elif fields == 'all':
+        fields = FIELDS
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f'unknown export fields: {", ".join(unknown)}')
+    return {name: FIELDS[name] for name in fields}
+
+
+class _IntColumn:
+    # Stored as int64 while loading, narrowed to `dtype` when every value fits.
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.values = array('q')
+        self.missing = False
+
+    def append(self, value):
+        if value is None:
+            self.missing = True
+            value = np.iinfo(np.int64).min
+        self.values.append(value)
+
+    def finish(self):
+        values = np.frombuffer(self.values, dtype=np.int64)
+        if self.missing:
+            return pd.arrays.IntegerArray(values.copy(), values == np.iinfo(np.int64).min)
+        info = np.iinfo(self.dtype)
+        if len(values) and (values.min() < info.min or values.max() > info.max):
+            return values
+        return values.astype(self.dtype)
+
+
+class _BoolColumn:
+    def __init__(self):
+        self.values = array('b')
+
+    def append(self, value):
+        self.values.append(-1 if value is None else bool(value))
+
+    def finish(self):
+        values = np.frombuffer(self.values, dtype=np.int8)
+        return pd.arrays.BooleanArray(values == 1, values < 0)
+
+
+class _StrColumn:
+    # Dictionary-encoded: one copy of every distinct string plus an int32 code
+    # per row. Missing values get code -1, as in pd.Categorical.
+    def __init__(self):
+        self.codes = array('i')
+        self.index = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def finish(self):
+        codes = np.frombuffer(self.codes, dtype=np.int32)
+        return pd.Categorical.from_codes(codes, categories=list(self.index))
+
+
+class _TsColumn:
+    # Spotify timestamps are fixed-width ASCII, so they are packed into a
+    # single bytes buffer instead of one str object per row.
+    def __init__(self):
+        self.values = bytearray()
+
+    def append(self, value):
+        if value is None or len(value) != TS_WIDTH:
+            raise ValueError(f'unexpected timestamp {value!r}')
+        self.values += value.encode('ascii')
+
+    def finish(self):
+        return pd.to_datetime(parse_timestamps(self.values), unit='s', utc=True)
+
+
+def _new_column(kind):
+    if kind == 'str':
+        return _StrColumn()
+    if kind == 'bool':
+        return _BoolColumn()
+    if kind == 'ts':
+        return _TsColumn()
+    return _IntColumn(kind)
+
+
+class ColumnBuffers:
+    """Append-only typed buffers for the requested fields (see field_kinds)."""
+
+    def __init__(self, fields=None):
+        self.fields = field_kinds(fields)
+        self.columns = [(name, _new_column(kind)) for name, kind in self.fields.items()]
+        self.rows = 0
+
+    def append(self, record):
+        get = record.get
+        for name, column in self.columns:
+            column.append(get(name))
+        self.rows += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def to_frame(self):
+        return pd.DataFrame({name: column.finish() for name, column in self.columns})
+
+
+def read_file(path, fields=None):
+    """Load a single export file into a DataFrame."""
+    return read_history([path], fields)
+
+
+def concat_frames(frames):
+    """Concatenate loaded frames in order, merging their string dictionaries."""
+    if len(frames) == 1:
+        return frames[0]
+    columns = {}
+    for name in frames[0].columns:
+        parts = [frame[name] for frame in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            columns[name] = union_categoricals(parts)
+        else:
+            columns[name] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_history(paths, fields=None, workers=1):
+    """Load every file in `paths` into one DataFrame, in the order given.
+
+    With `workers` > 1 the files are parsed in that many processes (None or 0
+    means one per core). Each worker sends back its file as a columnar frame,
+    which is cheap to pickle, and the frames are merged in `paths` order so
+    the result is the same as a serial load.
+    """
+    paths = list(paths)
+    if not workers:
+        workers = os.cpu_count()
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        buffers = ColumnBuffers(fields)
+        with stage('load.parse'):
+            for path in paths:
+                with open_export(path) as f:
+                    buffers.extend(iter_records(f))
+        with stage('load.columns'):
+            return buffers.to_frame()
+    with stage('load.parse'), ProcessPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(read_file, paths, repeat(fields)))
+    with stage('load.merge'):
+        return concat_frames(frames)
+
+
+def iter_frames(paths, fields=None, chunk_rows=CHUNK_ROWS):
+    """Yield the plays of `paths` as frames of at most `chunk_rows` rows.
+
+    Only one chunk is held in memory at a time, for histories that do not fit
+    in memory as a single frame.
+    """
+    buffers = ColumnBuffers(fields)
+    for path in paths:
+        with open_export(path) as f:
+            for record in iter_records(f):
+                buffers.append(record)
+                if buffers.rows == chunk_rows:
+                    yield buffers.to_frame()
+                    buffers = ColumnBuffers(fields)
+    if buffers.rows:
+        yield buffers.to_frame()
+
+
+def load_history(json_dir, fields=None, workers=1):
+    """Load all export files in `json_dir` into a single DataFrame."""
+    return read_history(history_files(json_dir), fields, workers)
+
+
+def epoch_seconds(ts, tz=None):
+    """Seconds since the epoch of a tz-aware timestamp column as int64.
+
+    With `tz`, the seconds are those of the wall clock in that timezone, so
+    hours and dates derived from them are local.
+    """
+    if tz is not None:
+        ts = ts.dt.tz_convert(tz)
+    return ts.dt.tz_localize(None).to_numpy().astype('datetime64[s]').view(np.int64)
+
+
+def add_time_features(df, tz=None):
+    """Add the hour/day/month/year and hours_played columns the charts use.
+
+    All features are small integers: hour 0-23, day_of_week 0-6 (Monday = 0)
+    and month 1-12; charts turn them into names with DAY_NAMES/MONTH_NAMES.
+    They are computed in UTC unless `tz` (e.g. 'Europe/Madrid') is given.
+    """
+    seconds = epoch_seconds(df['ts'], tz)
+    days = seconds // 86400
+    year, month, _ = civil_from_days(days)
+    df['hour'] = (seconds % 86400 // 3600).astype(np.int8)
+    df['day_of_week'] = ((days + 3) % 7).astype(np.int8)  # 1970-01-01 was a Thursday
+    df['month'] = month.astype(np.int8)
+    df['year'] = year.astype(np.int16)
+    df['hours_played'] = df['ms_played'] / 3600000
+    return df
+
+
+def _naive_column(column):
+    # What the column would cost loaded with plain pd.DataFrame(json.load(f)).
+    if isinstance(column.dtype, (pd.CategoricalDtype, pd.BooleanDtype, pd.Int64Dtype)):
+        return column.astype(object)
+    if column.dtype.kind in 'iu':
+        return column.astype(np.int64)
+    return column
+
+
+def memory_report(df):
+    """Bytes per row of `df` compared with object strings and int64 integers."""
+    naive = pd.DataFrame({name: _naive_column(df[name]) for name in df.columns})
+    before = int(naive.memory_usage(index=False, deep=True).sum())
+    after = int(df.memory_usage(index=False, deep=True).sum())
+    rows = max(len(df), 1)
+    return {
+        'rows': len(df),
+        'bytes_before': before,
+        'bytes_after': after,
+        'bytes_per_row_before': before / rows,
+        'bytes_per_row_after': after / rows,
+        'dropped_fields': sorted(set(FIELDS) - set(df.columns)),
+    }
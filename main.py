@@ -1,8 +1,13 @@
-import pandas as pd
-import json
-import os
+import argparse
+import sys
 import matplotlib.pyplot as plt
-import seaborn as sns
+from aggregate import aggregate, aggregate_chunked
+from cache import load_cached
+from charts import CHARTS, FORMATS, chart_data, draw_chart, render_cached
+from dedup import load_deduplicated
+from instrument import Profiler, stage
+from loader import load_history, add_time_features, memory_report
+from rollups import update_rollups
 #Creates graphics for:
 #Monthly Listening Time
 #Listening Hours vs. Days of the Week
@@ -10,116 +15,114 @@ import seaborn as sns
 #Top 10 Tracks by Listening Time
 #top Artists by Listening Time
 #Top 101 Artists by Listening Time
-
-
-# Load JSON files into a DataFrame
-json_dir = '/Users/roberto/OneDrive/Azure/Spotify/MyData2'
-dataframes = []
-
-for file in os.listdir(json_dir):
-    if file.endswith('.json'):
-        with open(os.path.join(json_dir, file), 'r') as f:
-            data = json.load(f)
-            dataframes.append(pd.DataFrame(data))
-
-df = pd.concat(dataframes, ignore_index=True) # One large dataframe creation from json files
-
-# Convert timestamp to datetime
-df['ts'] = pd.to_datetime(df['ts'])
-
-# Extract time-based features
-df['hour'] = df['ts'].dt.hour
-df['day_of_week'] = df['ts'].dt.day_name()
-df['month'] = df['ts'].dt.month_name()
-df['year'] = df['ts'].dt.year
-
-# Convert milliseconds to hours
-df['hours_played'] = df['ms_played'] / 3600000
-
-## Visualizations
-
-# Time series of total listening time
-plt.figure(figsize=(12, 6))
-df['year_month'] = df['ts'].dt.to_period('M')
-monthly_hours = df.groupby('year_month')['hours_played'].sum()
-ax = monthly_hours.plot(kind='bar', width=0.8, color=monthly_hours.index.year.map(lambda x: plt.cm.tab20(x % 20)))
-plt.title('Monthly Listening Time')
-plt.ylabel('Hours Played')
-plt.xlabel('Month/Year')
-ax.set_xticklabels([f"{x.month:02d}/{x.year % 100:02d}" for x in monthly_hours.index], rotation=90)
-
-# Add labels inside the bars
-for i, (index, value) in enumerate(monthly_hours.items()):
-    position = 'top' if i % 2 == 0 else 'bottom'
-    y = value + 0.5 if position == 'top' else value - 0.5
-    ax.text(i, y, f"{value:.1f}", ha='center', va=position, color='black')
-
-plt.tight_layout()
-plt.show()
-
-# Heatmap of listening hours vs. days of the week
-plt.figure(figsize=(14, 8))
-heatmap_data = df.groupby(['day_of_week', 'hour'])['hours_played'].sum().unstack()
-sns.heatmap(heatmap_data, cmap='viridis', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
-plt.title('Listening Hours vs. Days of the Week')
-plt.xlabel('Hour of the Day')
-plt.ylabel('Day of the Week')
-plt.tight_layout()
-plt.show()
-
-# Heatmap of listening hours per month of the year
-plt.figure(figsize=(14, 8))
-monthly_heatmap_data = df.groupby(['year', 'month'])['hours_played'].sum().unstack()
-sns.heatmap(monthly_heatmap_data, cmap='viridis', annot=True, fmt='.1f', linewidths=.5, cbar_kws={'label': 'Hours Played'})
-plt.title('Total Listening Hours per Month of the Year')
-plt.xlabel('Month')
-plt.ylabel('Year')
-plt.tight_layout()
-plt.show()
-
-## Data Analysis
-# Top 30 tracks
-plt.figure(figsize=(12, 6))
-top_tracks = df.groupby('master_metadata_track_name')['hours_played'].sum().nlargest(30)
-top_tracks.plot(kind='bar', title='Top 10 Tracks by Listening Time')
-plt.ylabel('Hours Played')
-plt.xlabel('Track Name')
-plt.xticks(rotation=90)
-plt.tight_layout()
-plt.show()
-
-# Top 50 artists by listening time  
-plt.figure(figsize=(12, 6))
-top_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(101)
-top_artists.plot(kind='bar', title='Top Artists by Listening Time')
-plt.ylabel('Hours Played')
-plt.xlabel('Artist Name')
-plt.xticks(rotation=90)
-plt.tight_layout()
-plt.show()
-
-# Heatmap of top 101 artists by listening time
-plt.figure(figsize=(12, 12))
-top_101_artists = df.groupby('master_metadata_album_artist_name')['hours_played'].sum().nlargest(101)
-top_101_artists_df = top_101_artists.reset_index()
-
-# Create a scatter plot with square markers
-plt.figure(figsize=(20, 5))
-plt.scatter(
-    x=top_101_artists_df['hours_played'],
-    y=top_101_artists_df['master_metadata_album_artist_name'],
-    s=top_101_artists_df['hours_played'] * 12,  # Adjust the size of the squares
-    c=top_101_artists_df['hours_played'] * 15,
-    cmap='viridis',
-    alpha=0.6,
-    edgecolors='w',
-    linewidth=2.5
-)
-
-plt.colorbar(label='Hours Played')
-plt.title('Top 101 Artists by Listening Time')
-plt.xlabel('Hours Played')
-plt.ylabel('Artist Name')
-plt.tight_layout()
-plt.show()
-
+#Podcast vs. Music Listening Time
+#Top 10 Podcast Shows
+
+JSON_DIR = '/Users/roberto/OneDrive/Azure/Spotify/MyData2'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Charts of a Spotify extended streaming history export.')
+    parser.add_argument('--json-dir', default=JSON_DIR, help='directory with the Streaming_History JSON files, or the export .zip')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes used to parse the export files (0 = one per core)')
+    parser.add_argument('--tz', help="timezone for hours and days in the charts, e.g. 'Australia/Sydney' "
+                                     "(default: UTC, as in the export)")
+    parser.add_argument('--cache-dir', help='keep a columnar cache of the parsed files here; '
+                                            'only new or changed files are parsed again')
+    parser.add_argument('--rollup-dir', help='keep per-file rollups here and only fold in new or changed '
+                                             'files instead of loading the whole history')
+    parser.add_argument('--backend', choices=['memory', 'chunked'], default='memory',
+                        help='chunked: stream the export in chunks and only keep their aggregates, '
+                             'for histories larger than memory')
+    parser.add_argument('--chunk-rows', type=int, default=500000, help='plays per chunk with --backend chunked')
+    parser.add_argument('--dedup-dir', help='drop plays repeated across overlapping exports, keeping the '
+                                            'index of plays already seen here (also with --rollup-dir; '
+                                            'not with --cache-dir or --backend chunked)')
+    parser.add_argument('--out', help='write the charts to this directory instead of showing them')
+    parser.add_argument('--formats', nargs='+', default=['png'], choices=FORMATS,
+                        help='file formats written with --out (html: interactive plotly pages)')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='print bytes per row of the loaded frame against a plain object-dtype load')
+    parser.add_argument('--profile-report', metavar='PATH',
+                        help='time every pipeline stage and write the results to PATH as JSON')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='with --profile-report, also record the peak traced memory of each stage')
+    parser.add_argument('--cprofile', metavar='PATH', help='dump cProfile statistics of the run to PATH')
+    args = parser.parse_args()
+    if args.backend == 'chunked' and (args.cache_dir or args.rollup_dir or args.memory_report):
+        parser.error('--backend chunked cannot be combined with --cache-dir, --rollup-dir or --memory-report')
+    if args.dedup_dir and (args.cache_dir or args.backend == 'chunked'):
+        parser.error('--dedup-dir cannot be combined with --cache-dir or --backend chunked')
+    return args
+
+
+def run(args):
+    if args.rollup_dir:
+        # Chart data from the persisted rollups, reading only new or changed files
+        with stage('rollups'):
+            agg, _ = update_rollups(args.json_dir, args.rollup_dir, workers=args.workers, tz=args.tz,
+                                    dedup_dir=args.dedup_dir)
+    elif args.backend == 'chunked':
+        # Aggregates of one chunk of the play log at a time, added up
+        with stage('aggregate'):
+            agg = aggregate_chunked(args.json_dir, args.chunk_rows, tz=args.tz, workers=args.workers)
+    else:
+        # Load JSON files into a DataFrame (streamed, optionally across worker processes)
+        if args.cache_dir:
+            with stage('load'):
+                df = load_cached(args.json_dir, args.cache_dir, workers=args.workers, tz=args.tz)
+        else:
+            with stage('load'):
+                if args.dedup_dir:
+                    df, dropped = load_deduplicated(args.json_dir, args.dedup_dir, workers=args.workers)
+                else:
+                    df = load_history(args.json_dir, workers=args.workers)
+            if args.dedup_dir:
+                for name, count in dropped.items():
+                    if count:
+                        print(f'{name}: dropped {count} plays already in other exports')
+
+            # Extract time-based features and convert milliseconds to hours
+            with stage('features'):
+                df = add_time_features(df, args.tz)
+
+        if args.memory_report:
+            report = memory_report(df)
+            print(f"{report['rows']} rows: {report['bytes_per_row_before']:.0f} bytes/row as object strings "
+                  f"and int64, {report['bytes_per_row_after']:.0f} bytes/row compact "
+                  f"(not loaded: {', '.join(report['dropped_fields'])})")
+
+        # All chart data in one pass over the play log
+        with stage('aggregate'):
+            agg = aggregate(df)
+
+    ## Visualizations
+    if args.out:
+        # Headless: write every chart to files, drawing them in parallel and
+        # skipping the charts whose data is unchanged since they were written
+        with stage('render'):
+            written, _ = render_cached(agg, args.out, formats=args.formats, workers=args.workers)
+        for paths in written.values():
+            print('\n'.join(paths))
+        return
+
+    for name in CHARTS:
+        with stage('render'):
+            draw_chart(name, chart_data(name, agg))
+        plt.show()
+
+
+def main():
+    args = parse_args()
+    if not (args.profile_report or args.cprofile):
+        run(args)
+        return
+    with Profiler(trace_memory=args.trace_memory, cprofile=args.cprofile) as profiler:
+        run(args)
+    print('\n'.join(profiler.summary()), file=sys.stderr)
+    if args.profile_report:
+        profiler.write(args.profile_report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Persisted rollups that are updated one export file at a time.
+
+The state directory keeps the Aggregates of every export file next to their
+sum. When files are added, changed or removed, only those files are read: the
+totals of their previous versions are subtracted and the new ones added, and
+the top-N lists are derived again from the updated totals.
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from aggregate import AGGREGATE_FIELDS, Aggregates, aggregate
+from cache import fingerprint, is_fresh, read_manifest, write_manifest
+from dedup import keep_masks, load_deduplicated, mask_digest, read_kept
+from loader import add_time_features, history_files, load_history, read_file
+
+ROLLUP_VERSION = 2
+TOTAL = 'total.npz'
+
+
+def _schema(tz):
+    return {'version': ROLLUP_VERSION, 'fields': AGGREGATE_FIELDS, 'tz': tz}
+
+
+def file_rollup(path, part_path, tz=None, keep=None):
+    """Aggregate one export file (only the plays in `keep`, if given) and save its rollup to `part_path`."""
+    df = read_file(path, AGGREGATE_FIELDS) if keep is None else read_kept(path, AGGREGATE_FIELDS, keep)
+    agg = aggregate(add_time_features(df, tz))
+    agg.save(part_path)
+    fp = fingerprint(path)
+    if keep is not None:
+        fp['keep'] = mask_digest(keep)
+    return agg, fp
+
+
+def update_rollups(json_dir, state_dir, workers=1, tz=None, dedup_dir=None):
+    """Fold new and changed export files into the rollups in `state_dir`.
+
+    With `dedup_dir`, plays repeated across overlapping exports are left out
+    as in dedup.load_deduplicated(); a file whose kept plays change (e.g.
+    when an older export holding some of them is removed) is read again.
+    Returns the updated total Aggregates and the names of the files that were
+    read (empty when nothing changed).
+    """
+    masks = keep_masks(json_dir, dedup_dir, workers) if dedup_dir else {}
+    os.makedirs(state_dir, exist_ok=True)
+    schema = _schema(tz)
+    previous = read_manifest(state_dir, schema)
+    total_path = os.path.join(state_dir, TOTAL)
+    parts_present = all(os.path.exists(os.path.join(state_dir, entry['part'])) for entry in previous.values())
+    if previous and parts_present and os.path.exists(total_path):
+        total = Aggregates.load(total_path)
+    else:
+        # No state yet, or it is incomplete: recompute every file.
+        previous = {}
+        total = Aggregates.empty()
+
+    files = {}
+    stale = []
+    # Set when is_fresh() re-hashed a file that was touched but not changed
+    # and updated its entry's mtime, so the file is not hashed again next run.
+    touched = False
+    for path in history_files(json_dir):
+        name = os.path.basename(path)
+        entry = previous.pop(name, None)
+        mtime_ns = entry and entry['mtime_ns']
+        digest = mask_digest(masks[name]) if dedup_dir else None
+        if is_fresh(entry, path) and entry.get('keep') == digest:
+            files[name] = entry
+            touched = touched or entry['mtime_ns'] != mtime_ns
+            continue
+        if entry is not None:
+            previous[name] = entry
+        stale.append(path)
+
+    # Build the new parts under temporary names first, so a file that fails
+    # to parse leaves the previous parts, total and manifest untouched.
+    part_names = [hashlib.sha1(os.path.basename(p).encode()).hexdigest()[:16] + '.npz' for p in stale]
+    new_paths = [os.path.join(state_dir, name[:-len('.npz')] + '.new.npz') for name in part_names]
+    keeps = [masks.get(os.path.basename(path)) for path in stale]
+    workers = min(workers or os.cpu_count(), len(stale))
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                built = list(pool.map(file_rollup, stale, new_paths, repeat(tz), keeps))
+        else:
+            built = [file_rollup(path, part, tz, keep) for path, part, keep in zip(stale, new_paths, keeps)]
+    except BaseException:
+        for path in new_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    # Take out files that were removed or are replaced.
+    for entry in previous.values():
+        part = os.path.join(state_dir, entry['part'])
+        total = total - Aggregates.load(part)
+        os.remove(part)
+    for path, part_name, new_path, (agg, fp) in zip(stale, part_names, new_paths, built):
+        os.replace(new_path, os.path.join(state_dir, part_name))
+        total = total + agg
+        files[os.path.basename(path)] = dict(fp, part=part_name)
+
+    if stale or previous or not os.path.exists(total_path):
+        total.save(total_path)
+        write_manifest(state_dir, schema, files)
+    elif touched:
+        write_manifest(state_dir, schema, files)
+    return total, [os.path.basename(path) for path in stale]
+
+
+def verify_rollups(json_dir, state_dir, workers=1, tz=None, dedup_dir=None):
+    """Check the persisted rollups against a full recompute from `json_dir`."""
+    total, _ = update_rollups(json_dir, state_dir, workers, tz, dedup_dir)
+    if dedup_dir:
+        df, _ = load_deduplicated(json_dir, dedup_dir, AGGREGATE_FIELDS, workers)
+    else:
+        df = load_history(json_dir, AGGREGATE_FIELDS, workers)
+    full = aggregate(add_time_features(df, tz))
+    return total.equals(full)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update persisted listening rollups from an export directory.')
+    parser.add_argument('json_dir')
+    parser.add_argument('state_dir')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tz', help='timezone for hours and dates (default: UTC)')
+    parser.add_argument('--dedup-dir', help='leave out plays repeated across overlapping exports, keeping '
+                                            'the index of plays already seen here (see dedup.py)')
+    parser.add_argument('--verify', action='store_true', help='also compare against a full recompute')
+    args = parser.parse_args()
+    total, read = update_rollups(args.json_dir, args.state_dir, args.workers, args.tz, args.dedup_dir)
+    print(f'read {len(read)} file(s); {total.total_hours:.1f} hours in total')
+    if args.verify:
+        ok = verify_rollups(args.json_dir, args.state_dir, args.workers, args.tz, args.dedup_dir)
+        print('rollups match a full recompute' if ok else 'rollups DIFFER from a full recompute')
+        raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
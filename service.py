@@ -0,0 +1,180 @@
+"""A local HTTP/JSON service with the chart aggregates of one export.
+
+The export is loaded once and reduced to per-year Aggregates; dashboards then
+ask the service for their data instead of loading the history themselves.
+Query results are kept in an LRU cache, which is cleared when the data is
+reloaded.
+
+    python service.py /path/to/MyData --port 8050
+
+    GET  /years
+    GET  /top/artists?n=10&years=2022,2023     (also /top/tracks, /top/shows)
+    GET  /day-hour?years=2023
+    GET  /monthly
+    GET  /year-month
+    GET  /content?years=2023
+    GET  /stats
+    POST /reload
+"""
+import argparse
+import json
+import math
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from aggregate import AGGREGATE_FIELDS, Aggregates, aggregate_by_year
+from cache import load_cached
+from loader import add_time_features, load_history
+
+TOP_DEFAULTS = {'artists': 101, 'tracks': 30, 'shows': 10}
+
+
+def _number(value):
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _series(series, key):
+    return [{key: str(label), 'hours': float(hours)} for label, hours in series.items()]
+
+
+def _matrix(frame):
+    return {
+        'rows': [str(label) for label in frame.index],
+        'columns': [str(label) for label in frame.columns],
+        'hours': [[_number(float(value)) for value in row] for row in frame.to_numpy()],
+    }
+
+
+class AggregateService:
+    """Per-year Aggregates of an export directory and cached queries on them."""
+
+    def __init__(self, json_dir, cache_dir=None, tz=None, workers=1, cache_size=256):
+        self.json_dir = json_dir
+        self.cache_dir = cache_dir
+        self.tz = tz
+        self.workers = workers
+        self.yearly = {}
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._cached = lru_cache(maxsize=cache_size)(self._query)
+        self.reload()
+
+    def reload(self):
+        """Load the export again and drop all cached results."""
+        if self.cache_dir:
+            df = load_cached(self.json_dir, self.cache_dir, AGGREGATE_FIELDS, self.workers, self.tz)
+        else:
+            df = add_time_features(load_history(self.json_dir, AGGREGATE_FIELDS, self.workers), self.tz)
+        yearly = aggregate_by_year(df)
+        with self._lock:
+            self.yearly = yearly
+            # Results still being computed from the old data are cached under
+            # the old generation, so they can never be served again.
+            self.generation += 1
+            self._cached.cache_clear()
+        return sorted(yearly)
+
+    def _aggregates(self, years):
+        if years is None:
+            years = self.yearly
+        return sum((self.yearly[year] for year in years if year in self.yearly), Aggregates.empty())
+
+    def query(self, path, years=None, n=None):
+        """The JSON-ready result of `path`; `years` is a sorted tuple or None for all."""
+        return self._cached(self.generation, path, years, n)
+
+    def _query(self, generation, path, years, n):
+        if path == '/years':
+            return sorted(self.yearly)
+        agg = self._aggregates(years)
+        if path.startswith('/top/'):
+            entity = path[len('/top/'):]
+            if entity not in TOP_DEFAULTS:
+                raise KeyError(path)
+            top = getattr(agg, f'top_{entity}')(TOP_DEFAULTS[entity] if n is None else n)
+            return _series(top, 'name')
+        if path == '/day-hour':
+            return _matrix(agg.day_hour_hours())
+        if path == '/year-month':
+            return _matrix(agg.year_month_hours())
+        if path == '/monthly':
+            return _series(agg.monthly_hours(), 'month')
+        if path == '/content':
+            return _series(agg.content_hours(), 'content_type')
+        raise KeyError(path)
+
+    def stats(self):
+        info = self._cached.cache_info()
+        return {'years': sorted(self.yearly), 'cache_hits': info.hits, 'cache_misses': info.misses,
+                'cached': info.currsize, 'cache_size': info.maxsize}
+
+
+def _params(query):
+    params = parse_qs(query)
+    years = params.get('years', [''])[0]
+    years = tuple(sorted({int(year) for year in years.split(',') if year})) or None
+    n = int(params['n'][0]) if 'n' in params else None
+    if n is not None and n < 1:
+        raise ValueError(f'n must be at least 1, got {n}')
+    return years, n
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                if url.path == '/stats':
+                    self._send(200, service.stats())
+                    return
+                years, n = _params(url.query)
+                self._send(200, service.query(url.path, years, n))
+            except KeyError:
+                self._send(404, {'error': f'unknown path {url.path}'})
+            except ValueError as exc:
+                self._send(400, {'error': str(exc)})
+
+        def do_POST(self):
+            if urlsplit(self.path).path != '/reload':
+                self._send(404, {'error': f'unknown path {self.path}'})
+                return
+            self._send(200, {'years': service.reload()})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the chart aggregates of an export as JSON.')
+    parser.add_argument('json_dir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--cache-dir', help='columnar cache of the parsed files, as in main.py')
+    parser.add_argument('--tz', help='timezone for hours and dates (default: UTC)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache-size', type=int, default=256, help='query results kept in the LRU cache')
+    args = parser.parse_args()
+    service = AggregateService(args.json_dir, args.cache_dir, args.tz, args.workers, args.cache_size)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f'serving {len(service.yearly)} year(s) of {args.json_dir} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
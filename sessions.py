@@ -0,0 +1,129 @@
+"""Listening sessions: runs of plays without a long pause between them.
+
+The export's `ts` is when a play ended, so a play started ms_played before
+it. Plays are put in end-time order once, and a new session starts wherever
+the gap between a play's start and the latest end so far exceeds the
+threshold. Everything is computed with array operations over the whole play
+log, so tens of millions of plays take seconds.
+
+    python sessions.py /path/to/MyData --gap 30 --out sessions.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from aggregate import ARTIST, MS_PER_HOUR, _codes
+from loader import epoch_seconds, load_history
+
+SESSION_FIELDS = ['ts', 'ms_played', ARTIST]
+
+
+def _play_times(df):
+    """End and start of every play in epoch milliseconds."""
+    end = epoch_seconds(df['ts']) * 1000
+    start = end - df['ms_played'].to_numpy(dtype=np.int64, na_value=0)
+    return start, end
+
+
+def _end_order(end):
+    # Exports are usually already in time order; only sort when they are not.
+    if len(end) < 2 or (np.diff(end) >= 0).all():
+        return np.arange(len(end))
+    return np.argsort(end, kind='stable')
+
+
+def _boundaries(start, end, gap_minutes):
+    """End-time order of the plays and the positions in it where sessions begin."""
+    order = _end_order(end)
+    start, end = start[order], end[order]
+    # Plays can overlap (e.g. on two devices), so compare with the latest end so far.
+    latest = np.maximum.accumulate(end)
+    new = np.empty(len(end), dtype=bool)
+    new[:1] = True
+    new[1:] = start[1:] - latest[:-1] > gap_minutes * 60000
+    return order, np.flatnonzero(new)
+
+
+def _ids(order, bounds):
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = np.repeat(np.arange(len(bounds)), np.diff(np.append(bounds, len(order))))
+    return ids
+
+
+def session_ids(df, gap_minutes=30):
+    """Session number of every play of `df`, numbered in time order."""
+    return _ids(*_boundaries(*_play_times(df), gap_minutes))
+
+
+def _dominant(ids, codes, ms, n_sessions):
+    """Code of the entity with the most ms in each session (-1 if none)."""
+    played = codes >= 0
+    ids, codes, ms = ids[played], codes[played], ms[played]
+    width = int(codes.max(initial=0)) + 1
+    pairs, inverse = np.unique(ids * width + codes, return_inverse=True)
+    totals = np.bincount(inverse, weights=ms)
+    pair_ids = pairs // width
+    # Sort by session, largest total first, and keep the first pair of each session.
+    order = np.lexsort((-totals, pair_ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_ids[order][1:] != pair_ids[order][:-1]
+    best = order[first]
+    dominant = np.full(n_sessions, -1, dtype=np.int64)
+    dominant[pair_ids[best]] = pairs[best] % width
+    return dominant
+
+
+def sessions(df, gap_minutes=30, tz=None):
+    """One row per session of the plays in `df`.
+
+    Columns: start, end (in `tz`, default UTC), duration, plays,
+    hours_played and dominant_artist (most hours in the session).
+    """
+    start, end = _play_times(df)
+    ms = df['ms_played'].to_numpy(dtype=np.int64, na_value=0)
+    order, bounds = _boundaries(start, end, gap_minutes)
+    n = len(bounds)
+    start, end, sorted_ms = start[order], end[order], ms[order]
+    if n:
+        first = np.minimum.reduceat(start, bounds)
+        last = np.maximum.reduceat(end, bounds)
+        listened = np.add.reduceat(sorted_ms, bounds)
+    else:
+        first = last = listened = np.zeros(0, dtype=np.int64)
+    ids = _ids(order, bounds)
+    codes, artists = _codes(df[ARTIST])
+    dominant = _dominant(ids, np.asarray(codes, dtype=np.int64), ms, n)
+    table = pd.DataFrame({
+        'start': pd.to_datetime(first, unit='ms', utc=True),
+        'end': pd.to_datetime(last, unit='ms', utc=True),
+        'duration': pd.to_timedelta(last - first, unit='ms'),
+        'plays': np.diff(np.append(bounds, len(order))),
+        'hours_played': listened / MS_PER_HOUR,
+        'dominant_artist': pd.Categorical.from_codes(dominant, categories=artists),
+    })
+    if tz is not None:
+        table['start'] = table['start'].dt.tz_convert(tz)
+        table['end'] = table['end'].dt.tz_convert(tz)
+    return table.rename_axis('session')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split the play log into listening sessions.')
+    parser.add_argument('json_dir')
+    parser.add_argument('--gap', type=float, default=30, help='minutes of silence that end a session')
+    parser.add_argument('--tz', help='timezone for session start and end times (default: UTC)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--out', help='write the session table to this CSV file')
+    args = parser.parse_args()
+    table = sessions(load_history(args.json_dir, SESSION_FIELDS, args.workers), args.gap, args.tz)
+    minutes = table['duration'].dt.total_seconds() / 60
+    print(f'{len(table)} sessions; median {minutes.median():.0f} min, mean {minutes.mean():.0f} min, '
+          f'{table["plays"].median():.0f} plays per session')
+    print(table.nlargest(10, 'duration').to_string())
+    if args.out:
+        table.to_csv(args.out)
+
+
+if __name__ == '__main__':
+    main()
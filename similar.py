@@ -0,0 +1,151 @@
+"""Artists that are listened to together.
+
+Plays are grouped into windows (listening sessions or calendar days) and a
+sparse window x artist incidence matrix is built from the integer artist
+codes. Its product with itself is the artist x artist co-listening matrix:
+how many windows two artists share. Artists are then ranked by cosine
+similarity, and the `k` most similar artists of every artist are saved as a
+compact index, so lookups do not touch the play log.
+
+    python similar.py build /path/to/MyData similar.npz --window session
+    python similar.py query similar.npz 'Tchaikovsky'
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from aggregate import ARTIST, _codes
+from loader import epoch_seconds, load_history
+from sessions import SESSION_FIELDS, session_ids
+
+WINDOWS = ('session', 'day')
+
+
+def window_ids(df, window='session', gap_minutes=30, tz=None):
+    """Number of the session or local calendar day of every play."""
+    if window == 'session':
+        return session_ids(df, gap_minutes)
+    if window == 'day':
+        return epoch_seconds(df['ts'], tz) // 86400
+    raise ValueError(f'unknown window {window!r}, expected one of {", ".join(WINDOWS)}')
+
+
+def colistening(windows, codes, n_artists):
+    """Sparse artist x artist matrix of the number of windows shared.
+
+    The diagonal holds the number of windows each artist was played in.
+    """
+    played = codes >= 0
+    windows, codes = windows[played], codes[played]
+    _, rows = np.unique(windows, return_inverse=True)
+    incidence = sparse.csr_matrix((np.ones(len(codes), dtype=np.int32), (rows, codes)),
+                                  shape=(rows.max(initial=-1) + 1, n_artists))
+    # Several plays of an artist in one window count once.
+    incidence.data[:] = 1
+    return (incidence.T @ incidence).tocsr()
+
+
+def top_similar(matrix, k=10, min_windows=2):
+    """The `k` artists most similar to each artist by cosine similarity.
+
+    Returns (neighbors, scores), both of shape (artists, k); unused slots
+    have neighbor -1 and score 0. Artists in fewer than `min_windows`
+    windows get no neighbors and are never a neighbor.
+    """
+    counts = matrix.diagonal().astype(np.float64)
+    kept = counts >= min_windows
+    norm = np.zeros_like(counts)
+    norm[kept] = 1 / np.sqrt(counts[kept])
+    scaled = sparse.diags(norm) @ matrix @ sparse.diags(norm)
+    scaled = scaled.tocsr()
+    scaled.setdiag(0)
+    scaled.eliminate_zeros()
+    n = matrix.shape[0]
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    indptr, indices, data = scaled.indptr, scaled.indices, scaled.data
+    for artist in np.flatnonzero(kept):
+        lo, hi = indptr[artist], indptr[artist + 1]
+        if lo == hi:
+            continue
+        row = data[lo:hi]
+        best = np.argpartition(-row, k - 1)[:k] if hi - lo > k else np.arange(hi - lo)
+        best = best[np.argsort(-row[best], kind='stable')]
+        neighbors[artist, :len(best)] = indices[lo:hi][best]
+        scores[artist, :len(best)] = row[best]
+    return neighbors, scores
+
+
+class SimilarityIndex:
+    """Most similar artists of every artist, as saved by build_index()."""
+
+    def __init__(self, names, neighbors, scores, windows):
+        self.names = list(names)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.windows = windows
+        self._codes = {name: code for code, name in enumerate(self.names)}
+
+    def save(self, path):
+        np.savez_compressed(path, names=np.array(json.dumps(self.names, ensure_ascii=False)),
+                            neighbors=self.neighbors, scores=self.scores, windows=self.windows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(json.loads(str(data['names'])), data['neighbors'], data['scores'], data['windows'])
+
+    def similar(self, artist, k=None):
+        """Series of similarity scores of the artists most similar to `artist`."""
+        code = self._codes[artist]
+        neighbors, scores = self.neighbors[code, :k], self.scores[code, :k]
+        found = neighbors >= 0
+        return pd.Series(scores[found], index=pd.Index([self.names[c] for c in neighbors[found]], name=ARTIST),
+                         name='similarity')
+
+
+def build_index(df, window='session', k=10, min_windows=2, gap_minutes=30, tz=None):
+    """Similarity index of the artists in a frame with ts, ms_played and artist."""
+    codes, names = _codes(df[ARTIST])
+    matrix = colistening(window_ids(df, window, gap_minutes, tz), np.asarray(codes, dtype=np.int64), len(names))
+    neighbors, scores = top_similar(matrix, k, min_windows)
+    return SimilarityIndex(names, neighbors, scores, matrix.diagonal().astype(np.int64))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Artists listened to in the same sessions or days.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='compute the similarity index of an export')
+    build.add_argument('json_dir')
+    build.add_argument('index', help='.npz file to write')
+    build.add_argument('--window', choices=WINDOWS, default='session')
+    build.add_argument('--gap', type=float, default=30, help='minutes of silence that end a session')
+    build.add_argument('--tz', help='timezone of calendar days (default: UTC)')
+    build.add_argument('-k', type=int, default=20, help='similar artists kept per artist')
+    build.add_argument('--min-windows', type=int, default=2,
+                       help='leave out artists played in fewer sessions or days')
+    build.add_argument('--workers', type=int, default=1)
+    query = commands.add_parser('query', help='list the artists most similar to an artist')
+    query.add_argument('index')
+    query.add_argument('artist')
+    query.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        df = load_history(args.json_dir, SESSION_FIELDS, args.workers)
+        index = build_index(df, args.window, args.k, args.min_windows, args.gap, args.tz)
+        index.save(args.index)
+        print(f'{len(index.names)} artists, {int((index.neighbors[:, 0] >= 0).sum())} with similar artists')
+        return
+    index = SimilarityIndex.load(args.index)
+    if args.artist not in index.names:
+        raise SystemExit(f'{args.artist!r} is not in the index')
+    for name, score in index.similar(args.artist, args.n).items():
+        print(f'{score:6.3f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
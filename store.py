@@ -0,0 +1,222 @@
+"""A play log store sorted by time, with posting lists per artist and track.
+
+build_store() writes the plays of an export directory as .npy columns sorted
+by timestamp: epoch seconds, ms_played and the artist/track/show codes. Each
+of artists and tracks also gets a posting list (CSR offsets plus row numbers)
+of the rows it was played in. Since rows are in time order, the rows of a
+posting list are too.
+
+A query binary-searches the time index (or the posting list of the artist or
+track asked for) for the date range, so it only reads the matching rows:
+
+    store = Store('/path/to/store')
+    store.hours(artist='Tchaikovsky', start='2023-01-01', end='2024-01-01')
+
+    python store.py build /path/to/MyData /path/to/store
+    python store.py query /path/to/store --artist Tchaikovsky --start 2023-01-01
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate import ARTIST, MS_PER_HOUR, SHOW, TRACK, _codes
+from cache import fingerprint, is_fresh, read_manifest, write_manifest
+from loader import epoch_seconds, history_files, load_history
+
+STORE_VERSION = 1
+STORE_FIELDS = ['ts', 'ms_played', TRACK, ARTIST, SHOW]
+# Entity -> export field; artists and tracks have posting lists.
+ENTITY_FIELDS = {'artist': ARTIST, 'track': TRACK, 'show': SHOW}
+INDEXED = ('artist', 'track')
+
+
+def _schema():
+    return {'version': STORE_VERSION, 'fields': STORE_FIELDS}
+
+
+def _save(store_dir, name, array):
+    np.save(os.path.join(store_dir, name + '.npy'), array)
+
+
+def _postings(codes, n):
+    """CSR posting lists: rows of code c are rows[offsets[c]:offsets[c + 1]]."""
+    played = codes >= 0
+    rows = np.flatnonzero(played)
+    # A stable sort keeps the rows of each code in time order.
+    rows = rows[np.argsort(codes[played], kind='stable')].astype(np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes[played], minlength=n), out=offsets[1:])
+    return offsets, rows
+
+
+def build_store(json_dir, store_dir, workers=1):
+    """Write the time-sorted store of `json_dir` unless it is up to date.
+
+    Returns True if the store was (re)built.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    paths = history_files(json_dir)
+    built = read_manifest(store_dir, _schema())
+    if (set(built) == {os.path.basename(path) for path in paths}
+            and all(is_fresh(built[os.path.basename(path)], path) for path in paths)):
+        write_manifest(store_dir, _schema(), built)
+        return False
+
+    df = load_history(json_dir, STORE_FIELDS, workers)
+    ts = epoch_seconds(df['ts'])
+    order = np.argsort(ts, kind='stable')
+    _save(store_dir, 'ts', ts[order])
+    _save(store_dir, 'ms_played', df['ms_played'].fillna(0).to_numpy()[order])
+    for entity, field in ENTITY_FIELDS.items():
+        codes, names = _codes(df[field])
+        codes = codes[order].astype(np.int32)
+        _save(store_dir, entity, codes)
+        with open(os.path.join(store_dir, entity + '_names.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(names), f, ensure_ascii=False)
+        if entity in INDEXED:
+            offsets, rows = _postings(codes, len(names))
+            _save(store_dir, entity + '_offsets', offsets)
+            _save(store_dir, entity + '_rows', rows)
+    write_manifest(store_dir, _schema(), {os.path.basename(path): fingerprint(path) for path in paths})
+    return True
+
+
+def _epoch(value, tz):
+    if value is None:
+        return None
+    stamp = pd.Timestamp(value)
+    if stamp.tzinfo is None:
+        stamp = stamp.tz_localize(tz or 'UTC')
+    return int(stamp.timestamp())
+
+
+class Store:
+    """Read access to a store written by build_store().
+
+    Columns are memory-mapped, so opening a store reads only the name lists
+    and queries page in just the rows they select.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        if not read_manifest(store_dir, _schema()):
+            raise FileNotFoundError(f'no play log store in {store_dir}')
+        self.ts = self._load('ts')
+        self.ms_played = self._load('ms_played')
+        self.codes = {entity: self._load(entity) for entity in ENTITY_FIELDS}
+        self.names = {}
+        self._lookup = {}
+        for entity in ENTITY_FIELDS:
+            with open(os.path.join(store_dir, entity + '_names.json'), encoding='utf-8') as f:
+                self.names[entity] = json.load(f)
+            self._lookup[entity] = {name: code for code, name in enumerate(self.names[entity])}
+        self.postings = {entity: (self._load(entity + '_offsets'), self._load(entity + '_rows'))
+                         for entity in INDEXED}
+
+    def _load(self, name):
+        return np.load(os.path.join(self.store_dir, name + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _posting(self, entity, name):
+        code = self._lookup[entity].get(name)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        offsets, rows = self.postings[entity]
+        return rows[offsets[code]:offsets[code + 1]]
+
+    def rows(self, start=None, end=None, artist=None, track=None, tz=None):
+        """Row numbers of the plays in [start, end) of `artist` and/or `track`.
+
+        Naive `start` and `end` are read in `tz` (default UTC). Without an
+        artist or track the result is a slice of the time index.
+        """
+        lo, hi = _epoch(start, tz), _epoch(end, tz)
+        lists = [self._posting(entity, name) for entity, name in (('artist', artist), ('track', track))
+                 if name is not None]
+        if not lists:
+            first = 0 if lo is None else int(np.searchsorted(self.ts, lo, 'left'))
+            last = len(self.ts) if hi is None else int(np.searchsorted(self.ts, hi, 'left'))
+            return slice(first, max(first, last))
+        lists.sort(key=len)
+        rows = lists[0]
+        # Posting lists are in time order, so the date range is a slice of the
+        # shortest one, found by searching the timestamps of its rows.
+        if lo is not None or hi is not None:
+            ts = self.ts[rows]
+            first = 0 if lo is None else np.searchsorted(ts, lo, 'left')
+            last = len(rows) if hi is None else np.searchsorted(ts, hi, 'left')
+            rows = rows[first:max(first, last)]
+        for other in lists[1:]:
+            rows = rows[np.isin(rows, other, assume_unique=True)]
+        return rows
+
+    def hours(self, **query):
+        """Hours played by the plays matching `query` (see rows())."""
+        return int(self.ms_played[self.rows(**query)].sum(dtype=np.int64)) / MS_PER_HOUR
+
+    def plays(self, **query):
+        rows = self.rows(**query)
+        return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+    def top(self, entity, n=10, **query):
+        """The `n` artists, tracks or shows with the most hours among the matching plays."""
+        rows = self.rows(**query)
+        codes = np.asarray(self.codes[entity][rows])
+        played = codes >= 0
+        hours = np.bincount(codes[played], weights=self.ms_played[rows][played],
+                            minlength=len(self.names[entity])) / MS_PER_HOUR
+        best = np.argsort(-hours, kind='stable')[:n]
+        best = best[hours[best] > 0]
+        return pd.Series(hours[best], index=pd.Index([self.names[entity][c] for c in best],
+                                                     name=ENTITY_FIELDS[entity]), name='hours_played')
+
+    def frame(self, **query):
+        """The matching plays as a frame of ts, ms_played, artist, track and show."""
+        rows = self.rows(**query)
+        columns = {
+            'ts': pd.to_datetime(np.asarray(self.ts[rows]), unit='s', utc=True),
+            'ms_played': np.asarray(self.ms_played[rows]),
+        }
+        for entity, field in ENTITY_FIELDS.items():
+            columns[field] = pd.Categorical.from_codes(np.asarray(self.codes[entity][rows]),
+                                                       categories=self.names[entity])
+        return pd.DataFrame(columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query a time-sorted play log store.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='write the store of an export directory')
+    build.add_argument('json_dir')
+    build.add_argument('store_dir')
+    build.add_argument('--workers', type=int, default=1)
+    query = commands.add_parser('query', help='hours and plays in a date range, optionally of one artist/track')
+    query.add_argument('store_dir')
+    query.add_argument('--start', help='first date or time included, e.g. 2023-01-01')
+    query.add_argument('--end', help='first date or time excluded')
+    query.add_argument('--tz', help='timezone of --start and --end (default: UTC)')
+    query.add_argument('--artist')
+    query.add_argument('--track')
+    query.add_argument('--top', choices=list(ENTITY_FIELDS), help='also list the top artists, tracks or shows')
+    query.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        rebuilt = build_store(args.json_dir, args.store_dir, args.workers)
+        print(f"{'built' if rebuilt else 'up to date'}: {len(Store(args.store_dir))} plays")
+        return
+    store = Store(args.store_dir)
+    selection = dict(start=args.start, end=args.end, tz=args.tz, artist=args.artist, track=args.track)
+    print(f'{store.plays(**selection)} plays, {store.hours(**selection):.2f} hours')
+    if args.top:
+        for name, hours in store.top(args.top, args.n, **selection).items():
+            print(f'{hours:9.2f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
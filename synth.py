@@ -0,0 +1,162 @@
+"""Synthetic Spotify extended streaming history exports for benchmarking.
+
+Writes Streaming_History_Audio_*.json files in the export's format: artist
+and track popularity follow Zipf distributions, a share of plays are podcast
+episodes, and timestamps span several years with more listening in the
+evening. Rows are generated with numpy in chunks, so even tens of millions of
+rows are written with bounded memory.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ven', 'to', 'shi', 'na', 'dor', 'el', 'quo', 'ri', 'sa', 'bel',
+             'mon', 'tha', 'ux', 'zen', 'pa', 'gri']
+PLATFORMS = ['ios', 'android', 'osx', 'windows', 'web_player', 'cast_to_device']
+COUNTRIES = ['AU', 'ES', 'MX', 'US', 'GB', 'DE']
+REASONS_START = ['trackdone', 'clickrow', 'fwdbtn', 'backbtn', 'playbtn', 'appload']
+REASONS_END = ['trackdone', 'endplay', 'fwdbtn', 'backbtn', 'logout', 'unexpected-exit-while-paused']
+BASE62 = np.array(list('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+# Relative amount of listening per hour of the day.
+HOUR_WEIGHTS = np.array([3, 2, 1, 1, 1, 1, 2, 4, 6, 6, 5, 5, 6, 6, 5, 5, 6, 7, 8, 9, 10, 10, 8, 5], dtype=float)
+
+
+def _names(rng, count, words, prefix=''):
+    parts = rng.integers(0, len(SYLLABLES), size=(count, words * 3))
+    names = []
+    for i, row in enumerate(parts):
+        name = ' '.join(''.join(SYLLABLES[s] for s in row[w * 3:w * 3 + 3]).title() for w in range(words))
+        names.append(f'{prefix}{name} {i}')
+    return names
+
+
+def _uris(rng, count, kind):
+    ids = BASE62[rng.integers(0, 62, size=(count, 22))]
+    return [f'spotify:{kind}:' + ''.join(row) for row in ids]
+
+
+def _zipf_p(count, s):
+    p = 1.0 / np.arange(1, count + 1) ** s
+    return p / p.sum()
+
+
+def _json(values):
+    return [json.dumps(v, ensure_ascii=False) for v in values]
+
+
+class Catalog:
+    """Artists, tracks and podcast shows to draw plays from."""
+
+    def __init__(self, rng, artists=5000, tracks_per_artist=25, shows=60, episodes_per_show=200):
+        self.artists = _json(_names(rng, artists, 2))
+        self.tracks_per_artist = tracks_per_artist
+        n_tracks = artists * tracks_per_artist
+        self.tracks = _json(_names(rng, n_tracks, 2))
+        self.albums = _json(_names(rng, artists * 3, 1, 'Album '))
+        self.track_uris = _json(_uris(rng, n_tracks, 'track'))
+        self.shows = _json(_names(rng, shows, 2, 'The '))
+        self.episodes_per_show = episodes_per_show
+        n_episodes = shows * episodes_per_show
+        self.episodes = _json(_names(rng, n_episodes, 3, 'Episode: '))
+        self.episode_uris = _json(_uris(rng, n_episodes, 'episode'))
+        self.artist_p = _zipf_p(artists, 1.1)
+        self.track_p = _zipf_p(tracks_per_artist, 0.9)
+        self.show_p = _zipf_p(shows, 1.2)
+
+
+def _records(rng, catalog, ts, podcast_share):
+    n = len(ts)
+    stamps = np.datetime_as_string(ts.astype('datetime64[s]'), unit='s')
+    podcast = rng.random(n) < podcast_share
+    artist = rng.choice(len(catalog.artist_p), size=n, p=catalog.artist_p)
+    track = artist * catalog.tracks_per_artist + rng.choice(catalog.tracks_per_artist, size=n, p=catalog.track_p)
+    album = artist * 3 + rng.integers(0, 3, size=n)
+    show = rng.choice(len(catalog.show_p), size=n, p=catalog.show_p)
+    episode = show * catalog.episodes_per_show + rng.integers(0, catalog.episodes_per_show, size=n)
+    skipped = rng.random(n) < 0.25
+    ms = np.where(skipped, rng.integers(0, 30000, size=n), rng.integers(90000, 420000, size=n))
+    ms = np.where(podcast, rng.integers(0, 3600000, size=n), ms)
+    platform = rng.integers(0, len(PLATFORMS), size=n)
+    country = rng.choice(len(COUNTRIES), size=n, p=[0.5, 0.2, 0.1, 0.1, 0.05, 0.05])
+    reason_start = rng.integers(0, len(REASONS_START), size=n)
+    reason_end = np.where(skipped, 2, rng.integers(0, len(REASONS_END), size=n))
+    shuffle = rng.random(n) < 0.4
+    offline = rng.random(n) < 0.05
+    ip = rng.integers(1, 255, size=(n, 4))
+
+    null = 'null'
+    for i in range(n):
+        if podcast[i]:
+            music = (null, null, null, null)
+            talk = (catalog.episodes[episode[i]], catalog.shows[show[i]], catalog.episode_uris[episode[i]])
+        else:
+            music = (catalog.tracks[track[i]], catalog.artists[artist[i]], catalog.albums[album[i]],
+                     catalog.track_uris[track[i]])
+            talk = (null, null, null)
+        yield (
+            f'{{"ts":"{stamps[i]}Z","platform":"{PLATFORMS[platform[i]]}","ms_played":{ms[i]},'
+            f'"conn_country":"{COUNTRIES[country[i]]}","ip_addr":"{ip[i, 0]}.{ip[i, 1]}.{ip[i, 2]}.{ip[i, 3]}",'
+            f'"master_metadata_track_name":{music[0]},"master_metadata_album_artist_name":{music[1]},'
+            f'"master_metadata_album_album_name":{music[2]},"spotify_track_uri":{music[3]},'
+            f'"episode_name":{talk[0]},"episode_show_name":{talk[1]},"spotify_episode_uri":{talk[2]},'
+            f'"audiobook_title":null,"audiobook_uri":null,"audiobook_chapter_uri":null,'
+            f'"audiobook_chapter_title":null,"reason_start":"{REASONS_START[reason_start[i]]}",'
+            f'"reason_end":"{REASONS_END[reason_end[i]]}","shuffle":{"true" if shuffle[i] else "false"},'
+            f'"skipped":{"true" if skipped[i] else "false"},"offline":{"true" if offline[i] else "false"},'
+            f'"offline_timestamp":{int(ts[i]) * 1000 if offline[i] else null},"incognito_mode":false}}'
+        )
+
+
+def _timestamps(rng, n, start, stop):
+    """`n` sorted epoch seconds in [start, stop), weighted by HOUR_WEIGHTS."""
+    days = rng.integers(start // 86400, stop // 86400, size=n)
+    hours = rng.choice(24, size=n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    ts = days * 86400 + hours * 3600 + rng.integers(0, 3600, size=n)
+    ts.sort()
+    return ts
+
+
+def generate(out_dir, rows, rows_per_file=20000, start_year=2014, years=10, podcast_share=0.08,
+             artists=5000, seed=0):
+    """Write `rows` synthetic plays to export files in `out_dir`; return their paths."""
+    rng = np.random.default_rng(seed)
+    catalog = Catalog(rng, artists=artists)
+    os.makedirs(out_dir, exist_ok=True)
+    start = int(np.datetime64(f'{start_year}-01-01', 's').astype(np.int64))
+    stop = int(np.datetime64(f'{start_year + years}-01-01', 's').astype(np.int64))
+    n_files = max(1, -(-rows // rows_per_file))
+    bounds = np.linspace(start, stop, n_files + 1).astype(np.int64)
+    paths = []
+    for i in range(n_files):
+        n = min(rows_per_file, rows - i * rows_per_file)
+        ts = _timestamps(rng, n, bounds[i], bounds[i + 1])
+        first, last = (np.datetime64(int(t), 's').astype(object).year for t in (bounds[i], bounds[i + 1] - 1))
+        path = os.path.join(out_dir, f'Streaming_History_Audio_{first}-{last}_{i}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('[\n')
+            f.write(',\n'.join(_records(rng, catalog, ts, podcast_share)))
+            f.write('\n]\n')
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Spotify streaming history exports.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--rows-per-file', type=int, default=20000)
+    parser.add_argument('--start-year', type=int, default=2014)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--podcast-share', type=float, default=0.08)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate(args.out_dir, args.rows, args.rows_per_file, args.start_year, args.years,
+                     args.podcast_share, args.artists, args.seed)
+    print(f'wrote {args.rows} plays to {len(paths)} file(s) in {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
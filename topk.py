@@ -0,0 +1,206 @@
+"""Approximate top tracks, artists and shows in one pass with fixed memory.
+
+The exact rankings in aggregate.py keep a total for every distinct track and
+artist, which grows with the number of histories aggregated together. Here
+each ranking is a weighted Space-Saving summary of `capacity` counters fed
+while the export files are streamed: plays are summed per name over a chunk
+of records, and the chunk totals are folded into the summaries.
+
+Space-Saving guarantees that every name holding more than total/capacity of
+the listening time is monitored, and that each reported total exceeds the
+true total by at most its recorded error, itself at most total/capacity.
+
+    python topk.py /path/to/MyData --epsilon 0.001
+"""
+import argparse
+import heapq
+import math
+
+import pandas as pd
+
+from aggregate import ARTIST, ENTITIES, MS_PER_HOUR, SHOW, TRACK
+from loader import history_files, iter_records, open_export
+
+ENTITY_FIELDS = {'artists': ARTIST, 'tracks': TRACK, 'shows': SHOW}
+CHUNK_ROWS = 50000
+
+
+class SpaceSaving:
+    """Weighted Space-Saving summary with `capacity` counters.
+
+    `counters` maps each monitored key to [estimate, error]: the true weight
+    of the key lies between estimate - error and estimate.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+        # (estimate, key) of every counter, plus stale entries of counters
+        # that have grown since or been evicted.
+        self._heap = []
+
+    def _pop_min(self):
+        heap, counters = self._heap, self.counters
+        while True:
+            estimate, key = heapq.heappop(heap)
+            counter = counters.get(key)
+            if counter is not None and counter[0] == estimate:
+                return estimate, key
+
+    def _compact(self):
+        self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, key, weight):
+        """Add `weight` (> 0) to `key`."""
+        if weight <= 0:
+            return
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[key] = [0, 0]
+            else:
+                # Replace the smallest counter; its estimate bounds the
+                # weight the new key may have had before.
+                floor, evicted = self._pop_min()
+                del self.counters[evicted]
+                counter = self.counters[key] = [floor, floor]
+        counter[0] += weight
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._compact()
+
+    def update(self, weights):
+        """Add a mapping of key -> weight."""
+        for key, weight in weights.items():
+            self.add(key, weight)
+
+    @property
+    def max_error(self):
+        """Largest possible overestimate of any key (0 while nothing was evicted)."""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def ranking(self, n):
+        """The `n` largest estimates as a frame of estimate, error and guaranteed.
+
+        A key is `guaranteed` to be among the true top `n` when its lower
+        bound is at least the estimate of every key ranked after it.
+        """
+        top = heapq.nlargest(n + 1, self.counters.items(), key=lambda item: item[1][0])
+        rest = top[n][1][0] if len(top) > n else self.max_error
+        top = top[:n]
+        frame = pd.DataFrame({
+            'estimate': [counter[0] for _, counter in top],
+            'error': [counter[1] for _, counter in top],
+        }, index=pd.Index([key for key, _ in top]))
+        frame['guaranteed'] = frame['estimate'] - frame['error'] >= rest
+        return frame
+
+
+def _chunk_totals(records):
+    totals = {entity: {} for entity in ENTITIES}
+    fields = [(ENTITY_FIELDS[entity], totals[entity]) for entity in ENTITIES]
+    for record in records:
+        ms = record.get('ms_played') or 0
+        for field, sums in fields:
+            name = record.get(field)
+            if name is not None:
+                sums[name] = sums.get(name, 0) + ms
+    return totals
+
+
+def _chunks(paths, chunk_rows):
+    chunk = []
+    for path in paths:
+        with open_export(path) as f:
+            for record in iter_records(f):
+                chunk.append(record)
+                if len(chunk) == chunk_rows:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+class TopK:
+    """Approximate rankings of artists, tracks and shows by listening time."""
+
+    def __init__(self, epsilon=0.001):
+        self.epsilon = epsilon
+        self.capacity = math.ceil(1 / epsilon)
+        self.summaries = {entity: SpaceSaving(self.capacity) for entity in ENTITIES}
+
+    def update(self, records):
+        """Fold a batch of export records into the summaries."""
+        for entity, sums in _chunk_totals(records).items():
+            self.summaries[entity].update(sums)
+
+    def error_hours(self, entity):
+        """Largest overestimate of any hours_played in the `entity` ranking."""
+        return self.summaries[entity].max_error / MS_PER_HOUR
+
+    def ranking(self, entity, n):
+        """Frame of hours_played, error_hours and guaranteed for the top `n`."""
+        ranking = self.summaries[entity].ranking(n)
+        return pd.DataFrame({
+            'hours_played': ranking['estimate'] / MS_PER_HOUR,
+            'error_hours': ranking['error'] / MS_PER_HOUR,
+            'guaranteed': ranking['guaranteed'],
+        }).rename_axis(ENTITY_FIELDS[entity])
+
+    def top(self, entity, n):
+        """The top `n` as a Series shaped like Aggregates.top_artists() and friends."""
+        return self.ranking(entity, n)['hours_played']
+
+    def top_tracks(self, n=30):
+        return self.top('tracks', n)
+
+    def top_artists(self, n=101):
+        return self.top('artists', n)
+
+    def top_shows(self, n=10):
+        return self.top('shows', n)
+
+
+def stream_top(paths, epsilon=0.001, chunk_rows=CHUNK_ROWS):
+    """Approximate top artists, tracks and shows of export files in one pass.
+
+    Memory is bounded by `chunk_rows` records plus 1/`epsilon` counters per
+    ranking, however many files and distinct names there are.
+    """
+    top = TopK(epsilon)
+    for chunk in _chunks(paths, chunk_rows):
+        top.update(chunk)
+    return top
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Approximate top tracks, artists and shows in one pass.')
+    parser.add_argument('json_dirs', nargs='+', help='export directories, streamed one after another')
+    parser.add_argument('--epsilon', type=float, default=0.001,
+                        help='error bound as a share of the total listening time (default: 0.001)')
+    parser.add_argument('--tracks', type=int, default=30)
+    parser.add_argument('--artists', type=int, default=101)
+    parser.add_argument('--shows', type=int, default=10)
+    args = parser.parse_args()
+    paths = [path for json_dir in args.json_dirs for path in history_files(json_dir)]
+    top = stream_top(paths, args.epsilon)
+    for entity, n in (('tracks', args.tracks), ('artists', args.artists), ('shows', args.shows)):
+        summary = top.summaries[entity]
+        print(f'Top {n} {entity}: {summary.total / MS_PER_HOUR:.1f} hours in total, estimates at most '
+              f'{top.error_hours(entity):.2f} hours high ({len(summary.counters)} of {top.capacity} counters)')
+        ranking = top.ranking(entity, n)
+        for rank, (name, row) in enumerate(ranking.iterrows(), 1):
+            mark = '' if row['guaranteed'] else '  ?'
+            print(f"{rank:4d}. {row['hours_played']:9.2f} h  (-{row['error_hours']:.2f})  {name}{mark}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Keep the rollups and chart files up to date while exports land in a folder.
+
+The export directory is polled every `interval` seconds. Once a change has
+settled (no further change for `debounce` seconds, so a large file being
+copied or a whole export being unzipped is picked up in one go), only the
+added or changed files are folded into the rollups, and only the charts whose
+data changed are drawn again.
+
+    python watch.py /path/to/MyData state/ charts/
+    python watch.py my_spotify_data.zip state/ charts/
+"""
+import argparse
+import os
+import sys
+import time
+import zipfile
+
+from charts import FORMATS, render_cached
+from loader import export_stat, history_files
+from rollups import update_rollups
+
+
+def snapshot(json_dir):
+    """{file name: (size, mtime_ns)} of the export files in `json_dir` (a directory or .zip)."""
+    try:
+        paths = history_files(json_dir)
+    except (OSError, zipfile.BadZipFile):
+        # An archive that is still being copied: the next poll sees it again.
+        return {}
+    files = {}
+    for path in paths:
+        try:
+            files[os.path.basename(path)] = export_stat(path)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            # Removed or replaced between listing and stat.
+            continue
+    return files
+
+
+def wait_for_change(json_dir, seen, interval=2.0, debounce=5.0):
+    """Block until the files in `json_dir` differ from `seen` and have settled.
+
+    Returns the settled snapshot.
+    """
+    current = snapshot(json_dir)
+    while current == seen:
+        time.sleep(interval)
+        current = snapshot(json_dir)
+    settled_at = time.monotonic()
+    while time.monotonic() - settled_at < debounce:
+        time.sleep(min(interval, debounce))
+        latest = snapshot(json_dir)
+        if latest != current:
+            current, settled_at = latest, time.monotonic()
+    return current
+
+
+def refresh(json_dir, state_dir, out_dir, formats=('png',), workers=1, tz=None, dedup_dir=None):
+    """Update the rollups and redraw the charts whose data changed.
+
+    Returns the names of the files read and of the charts drawn.
+    """
+    agg, read = update_rollups(json_dir, state_dir, workers=workers, tz=tz, dedup_dir=dedup_dir)
+    _, drawn = render_cached(agg, out_dir, formats=formats, workers=workers)
+    return read, drawn
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Redraw the charts whenever the export files change.')
+    parser.add_argument('json_dir')
+    parser.add_argument('state_dir', help='where the per-file rollups are kept')
+    parser.add_argument('out_dir', help='where the charts are written')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between polls')
+    parser.add_argument('--debounce', type=float, default=5.0,
+                        help='seconds without further changes before a change is processed')
+    parser.add_argument('--formats', nargs='+', default=['png'], choices=FORMATS)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tz', help='timezone for hours and dates (default: UTC)')
+    parser.add_argument('--dedup-dir', help='leave out plays repeated across overlapping exports, keeping '
+                                            'the index of plays already seen here')
+    args = parser.parse_args()
+
+    seen = snapshot(args.json_dir)
+    while True:
+        started = time.monotonic()
+        try:
+            read, drawn = refresh(args.json_dir, args.state_dir, args.out_dir, args.formats, args.workers, args.tz,
+                                  args.dedup_dir)
+        except Exception as exc:
+            # E.g. a file still being copied or a malformed export: the rollups
+            # are left as they were, and the next change is tried again.
+            print(f"{time.strftime('%H:%M:%S')} refresh failed: {type(exc).__name__}: {exc}",
+                  file=sys.stderr, flush=True)
+        else:
+            print(f"{time.strftime('%H:%M:%S')} read {len(read)} file(s), drew "
+                  f"{', '.join(drawn) if drawn else 'no charts'} in {time.monotonic() - started:.1f} s", flush=True)
+        try:
+            seen = wait_for_change(args.json_dir, seen, args.interval, args.debounce)
+        except KeyboardInterrupt:
+            return
+
+
+if __name__ == '__main__':
+    main()